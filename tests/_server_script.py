@@ -1,4 +1,5 @@
 import asyncio
+import os
 
 from urp import Service, method
 
@@ -37,5 +38,13 @@ class Example:
     def error(self, msg):
         raise Exception(msg)
 
+    @method
+    def pid(self):
+        return {"pid": os.getpid()}
+
+    @method
+    def crash(self):
+        os._exit(1)
+
 
-asyncio.run(serv.serve_stdio())
+serv.run_stdio()
@@ -4,6 +4,7 @@ import socket
 import pytest
 
 from urp.client import client_from_inherited_socket, errors
+from urp.common import MsgType
 from urp.framework import Service, method
 
 from .utils import aenumerate
@@ -128,3 +129,33 @@ async def test_errors(linked_pair):
             assert i == 0
             assert isinstance(result, errors['builtins.Exception'])
             assert str(result) == "spam&eggs"
+
+
+async def raw_call(client, name, args, options):
+    """
+    Makes a call with options straight off the wire, collecting the packets.
+    """
+    got = []
+    with client.urp_open_channel() as (send, queue):
+        await send(MsgType.Call, name, args, 999, options)
+        while True:
+            msg = await asyncio.wait_for(queue.get(), 5)
+            got.append(msg)
+            if msg[0] == MsgType.Shoosh:
+                return got
+
+
+@pytest.mark.asyncio
+async def test_junk_priority(linked_pair):
+    client, stask = linked_pair
+    async with client:
+        got = await raw_call(client, 'example.sync', {}, {'priority': "high"})
+        assert got == [[MsgType.Return, {"spam": "eggs"}], [MsgType.Shoosh]]
+
+
+@pytest.mark.asyncio
+async def test_nil_options(linked_pair):
+    client, stask = linked_pair
+    async with client:
+        got = await raw_call(client, 'example.sync', {}, None)
+        assert got == [[MsgType.Return, {"spam": "eggs"}], [MsgType.Shoosh]]
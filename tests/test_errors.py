@@ -0,0 +1,96 @@
+import asyncio
+import socket
+
+import pytest
+
+from urp.client import client_from_inherited_socket
+from urp.codec import ApplicationError, ErrorRegistry, get_error, register_error
+from urp.framework import Service, method
+
+
+@register_error("test.Spam")
+class SpamError(Exception):
+    pass
+
+
+class EggsError(Exception):
+    def __init__(self, count):
+        super().__init__(f"{count} eggs")
+        self.count = count
+
+
+register_error("test.Eggs", EggsError, encode=lambda exc: [exc.count])
+
+
+@pytest.fixture
+async def client():
+    serv = Service("urp-test")
+
+    @serv.interface("example")
+    class Example:
+        @method
+        def spam(self):
+            raise SpamError("spam", 42)
+
+        @method
+        def eggs(self):
+            raise EggsError(3)
+
+    csock, ssock = socket.socketpair()
+    server_task = asyncio.create_task(serv.serve_inherited_socket(ssock))
+    client = await client_from_inherited_socket(csock)
+    async with client:
+        yield client
+    server_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_registered(client):
+    async for result in client['example.spam']():
+        assert type(result) is SpamError
+        assert result.args == ("spam", 42)
+
+
+@pytest.mark.asyncio
+async def test_encoder(client):
+    async for result in client['example.eggs']():
+        assert type(result) is EggsError
+        assert result.count == 3
+        assert str(result) == "3 eggs"
+
+
+def test_bounded():
+    registry = ErrorRegistry(maxsize=2)
+    spam = registry['dyn.Spam']
+    assert issubclass(spam, ApplicationError)
+    assert registry['dyn.Spam'] is spam
+    registry['dyn.Eggs']
+    registry['dyn.Spam']  # Refresh
+    registry['dyn.Bacon']
+    assert 'dyn.Spam' in registry
+    assert 'dyn.Eggs' not in registry
+
+
+def test_additional_untouched():
+    additional = {'msg': "boom", 'args': ["boom"], 'extra': 1}
+    err = get_error('builtins.Exception', additional)
+    assert str(err) == "boom"
+    assert err.extra == 1
+    assert additional == {'msg': "boom", 'args': ["boom"], 'extra': 1}
+
+
+def test_init_mismatch():
+    registry = ErrorRegistry()
+
+    @registry.register("test.Quota")
+    class QuotaError(Exception):
+        def __init__(self, user, limit):
+            super().__init__(f"{user} is over {limit}")
+            self.user = user
+            self.limit = limit
+
+    name, additional = registry.serialize(QuotaError("spam", 10))
+    err = registry.instantiate(name, additional)
+    assert type(err) is QuotaError
+    assert str(err) == "spam is over 10"
+    assert (err.user, err.limit) == ("spam", 10)
@@ -0,0 +1,136 @@
+import array
+import asyncio
+import datetime
+import socket
+import uuid
+
+import msgpack
+import pytest
+
+from urp.client import client_from_inherited_socket
+from urp.codec import ExtRegistry, ext_types, packb, unpackb, register_ext_type
+from urp.framework import Service, method
+
+
+class Point:
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+
+@pytest.fixture
+def point_type():
+    register_ext_type(
+        1, Point,
+        lambda p: packb([p.x, p.y]),
+        lambda data: Point(*unpackb(data)),
+    )
+    yield
+    ext_types.unregister(1)
+
+
+@pytest.fixture
+async def client(point_type):
+    serv = Service("urp-test")
+
+    @serv.interface("example")
+    class Example:
+        @method("Echo")
+        def ping(self, **args):
+            return args
+
+        @method
+        def total(self, values):
+            return {'format': values.format, 'total': sum(values)}
+
+        @method
+        def heightmap(self):
+            return {'value': array.array('h', range(-5, 5))}
+
+    csock, ssock = socket.socketpair()
+    server_task = asyncio.create_task(serv.serve_inherited_socket(ssock))
+    client = await client_from_inherited_socket(csock)
+    async with client:
+        yield client
+    server_task.cancel()
+
+
+async def echo(client, value):
+    async for result in client['example.Echo'](value=value):
+        return result['value']
+
+
+@pytest.mark.asyncio
+async def test_builtins(client):
+    naive = datetime.datetime(2020, 1, 2, 3, 4, 5, 6)
+    aware = datetime.datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=datetime.timezone.utc)
+    ident = uuid.uuid4()
+    assert await echo(client, naive) == naive
+    assert await echo(client, aware) == aware
+    assert await echo(client, ident) == ident
+
+
+@pytest.mark.asyncio
+async def test_array(client):
+    async for result in client['example.heightmap']():
+        heights = result['value']
+    assert isinstance(heights, memoryview)
+    assert heights.format == 'h'
+    assert heights.tolist() == list(range(-5, 5))
+
+    async for result in client['example.total'](values=array.array('d', [1.5, 2.5])):
+        assert result == {'format': 'd', 'total': 4.0}
+
+
+def test_array_typecodes():
+    # l is sent as the fixed-size code of the same size
+    got = unpackb(packb(array.array('l', [1, -2])))
+    assert got.format in ('i', 'q')
+    assert got.tolist() == [1, -2]
+    with pytest.raises(TypeError):
+        packb(array.array('u', 'spam'))
+    # Junk from the other end is left alone rather than breaking the unpacker
+    assert unpackb(packb(msgpack.ExtType(122, b'u\0\0\0\0'))).code == 122
+    assert unpackb(packb(msgpack.ExtType(122, b'h\0'))).code == 122
+
+
+@pytest.mark.parametrize('code, data', [
+    (120, b'\xff\xfe'),
+    (121, b'short'),
+    (122, b''),
+    (123, b'\x03abc'),
+])
+def test_malformed(code, data):
+    got = unpackb(packb(msgpack.ExtType(code, data)))
+    assert got == msgpack.ExtType(code, data)
+
+
+@pytest.mark.asyncio
+async def test_numpy(client):
+    numpy = pytest.importorskip('numpy')
+    arr = numpy.arange(12, dtype='<i4').reshape(3, 4)
+    result = await echo(client, arr)
+    assert (result == arr).all()
+    assert result.dtype == arr.dtype
+    # A view, not a copy
+    assert not result.flags.owndata
+
+    result = await echo(client, numpy.array(5.0))
+    assert result.shape == ()
+    assert result == 5.0
+
+
+@pytest.mark.asyncio
+async def test_registered(client):
+    result = await echo(client, Point(1, 2))
+    assert isinstance(result, Point)
+    assert (result.x, result.y) == (1, 2)
+
+
+def test_registry():
+    registry = ExtRegistry()
+    with pytest.raises(ValueError):
+        registry.register(128, Point, bytes, bytes)
+    with pytest.raises(TypeError):
+        registry.default(object())
+    # Unknown codes are left as ExtType
+    assert registry.ext_hook(99, b'x').data == b'x'
@@ -0,0 +1,85 @@
+import asyncio
+import socket
+
+import pytest
+
+from urp.client import client_from_inherited_socket
+from urp.framework import Service, method
+from urp.hedge import HedgedClient
+
+
+def make_replica(name, delay, cancelled):
+    serv = Service("urp-test")
+
+    @serv.interface("example")
+    class Example:
+        @method
+        async def read(self):
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(name)
+                raise
+            return {"replica": name}
+
+    return serv
+
+
+@pytest.fixture
+async def replicas():
+    cancelled = []
+    tasks = []
+    clients = []
+    for name, delay in [("slow", 0.3), ("fast", 0)]:
+        csock, ssock = socket.socketpair()
+        serv = make_replica(name, delay, cancelled)
+        tasks.append(asyncio.create_task(serv.serve_inherited_socket(ssock)))
+        clients.append(await client_from_inherited_socket(csock))
+    yield clients, cancelled
+    for client in clients:
+        await client.close()
+    for t in tasks:
+        t.cancel()
+
+
+async def read(client, key='example.read'):
+    return [r async for r in client[key]()]
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins(replicas):
+    clients, cancelled = replicas
+    client = HedgedClient(clients, hedged={'example.read'}, initial_delay=0.01, budget=1)
+    assert await read(client) == [{"replica": "fast"}]
+    assert client.hedges == 1
+    assert client.hedge_wins == 1
+    # The slow replica was Shooshed
+    for _ in range(100):
+        if cancelled:
+            break
+        await asyncio.sleep(0.01)
+    assert cancelled == ["slow"]
+
+
+@pytest.mark.asyncio
+async def test_unhedged(replicas):
+    clients, cancelled = replicas
+    client = HedgedClient(clients, initial_delay=0.01, budget=1)
+    assert await read(client) == [{"replica": "slow"}]
+    assert client.hedges == 0
+
+
+@pytest.mark.asyncio
+async def test_budget(replicas):
+    clients, cancelled = replicas
+    client = HedgedClient(clients, hedged={'example.read'}, initial_delay=0.01, budget=0)
+    assert await read(client) == [{"replica": "slow"}]
+    assert client.hedges == 0
+
+
+@pytest.mark.asyncio
+async def test_delay():
+    client = HedgedClient([object()], initial_delay=0.5)
+    assert client.delay('example.read') == 0.5
+    client._latencies['example.read'].extend(i / 100 for i in range(100))
+    assert client.delay('example.read') == 0.94
@@ -0,0 +1,117 @@
+import asyncio
+from pathlib import Path
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from urp.client import client_from_inherited_socket
+from urp.framework import Service, method
+from urp.loadgen import LoadGenerator, percentile
+
+SCRIPT = Path(__file__).absolute().parent / "_server_script.py"
+
+
+@pytest.fixture
+def service():
+    serv = Service("urp-test")
+
+    @serv.interface("example")
+    class Example:
+        @method("Echo")
+        def ping(self, **args):
+            return args
+
+        @method
+        async def stream(self):
+            for i in range(5):
+                await asyncio.sleep(0.01)
+                yield {"i": i}
+
+        @method
+        def error(self):
+            raise ValueError
+
+        @method
+        def stats(self):
+            return serv.stats()
+
+        @method
+        async def stubborn(self):
+            yield {}
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                # Leaky handler that won't stop when told to
+                await serv.shared.get_or_create('release', asyncio.Event).wait()
+
+    return serv
+
+
+@pytest.mark.asyncio
+async def test_loadgen(service):
+    csock, ssock = socket.socketpair()
+    server_task = asyncio.create_task(service.serve_inherited_socket(ssock))
+    client = await client_from_inherited_socket(csock)
+    async with client:
+        gen = LoadGenerator(client, [
+            ('unary', 'example.Echo', {'spam': 'eggs'}, 5),
+            ('stream', 'example.stream', {}, 2),
+            ('cancel', 'example.stream', {}, 2),
+            ('error', 'example.error', {}, 1),
+        ], rate=200, stats='example.stats')
+        samples = await gen.run(0.5, interval=0.25)
+
+        assert len(samples) >= 2
+        assert sum(s['rate'] for s in samples) > 0
+        assert all(s['unexpected'] == 0 and s['failures'] == 0 for s in samples)
+        # Nothing left over
+        assert samples[-1]['client'] == {'channels': 0, 'tasks': 0}
+        await asyncio.sleep(0.1)
+        # The stats call itself (its channel and method tasks) is the only
+        # thing open
+        async for stats in client['example.stats']():
+            assert stats == {'connections': 1, 'channels': 1, 'tasks': 2}
+    server_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_leak_visible(service):
+    csock, ssock = socket.socketpair()
+    server_task = asyncio.create_task(service.serve_inherited_socket(ssock))
+    client = await client_from_inherited_socket(csock)
+    async with client:
+        async for _ in client['example.stubborn']():
+            break
+        await asyncio.sleep(0.1)
+        # Shooshed, but still running
+        assert service.stats() == {'connections': 1, 'channels': 1, 'tasks': 2}
+        service.shared['release'].set()
+        await asyncio.sleep(0.1)
+        assert service.stats() == {'connections': 1, 'channels': 0, 'tasks': 0}
+    server_task.cancel()
+
+
+def test_percentile():
+    values = list(range(1, 1001))
+    assert percentile(values, 0.5) == 500
+    assert percentile(values, 0.99) == 990
+    assert percentile(values, 0.999) == 999
+    assert percentile([], 0.5) is None
+
+
+def test_cli():
+    proc = subprocess.run(
+        [
+            sys.executable, '-m', 'urp.loadgen',
+            '--spawn', f"{sys.executable} {SCRIPT}",
+            '--mix', 'unary:example.Echo:3', '--mix', 'error:example.error',
+            '--params', 'example.error={"msg": "boom"}',
+            '--rate', '100', '--duration', '0.5', '--interval', '0.25',
+        ],
+        capture_output=True, text=True, timeout=10,
+    )
+    assert proc.returncode == 0, proc.stdout + proc.stderr
+    assert 'p99=' in proc.stdout
+    assert 'RSS growth' in proc.stdout
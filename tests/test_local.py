@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from urp.client import errors
+from urp.common import Disconnected
+from urp.framework import Service, method
+from urp.local import connect_local
+
+from .utils import aenumerate
+
+
+@pytest.fixture
+def service():
+    serv = Service("urp-test")
+    events = serv.topic("events")
+
+    @serv.interface("example")
+    class Example:
+        @method("Echo")
+        def ping(self, **args):
+            return args
+
+        @method
+        async def async_gen(self):
+            yield {"spam": "eggs"}
+            yield {"foo": "bar"}
+
+        @method
+        async def forever(self):
+            yield {}
+            await asyncio.Event().wait()
+
+        @method
+        def error(self, msg):
+            raise Exception(msg)
+
+        @method
+        def subscribe(self):
+            return events.subscribe()
+
+        @method
+        def stats(self):
+            return serv.stats()
+
+    return serv
+
+
+@pytest.mark.asyncio
+async def test_roundtrip(service):
+    async with connect_local(service) as client:
+        payload = {'spam': ['eggs']}
+        async for i, result in aenumerate(client['example.Echo'](data=payload)):
+            assert i == 0
+            # By reference
+            assert result['data'] is payload
+
+
+@pytest.mark.asyncio
+async def test_copies(service):
+    for mode in ('deep', 'msgpack'):
+        async with connect_local(service, copy=mode) as client:
+            payload = {'spam': ['eggs']}
+            async for result in client['example.Echo'](data=payload):
+                assert result == {'data': payload}
+                assert result['data'] is not payload
+
+
+@pytest.mark.asyncio
+async def test_msgpack_validates(service):
+    async with connect_local(service, copy='msgpack') as client:
+        with pytest.raises(TypeError):
+            async for result in client['example.Echo'](data=object()):
+                pass
+
+
+@pytest.mark.asyncio
+async def test_stream_and_errors(service):
+    async with connect_local(service) as client:
+        results = [r async for r in client['example.async_gen']()]
+        assert results == [{"spam": "eggs"}, {"foo": "bar"}]
+
+        results = [r async for r in client['example.error'](msg="spam&eggs")]
+        assert isinstance(results[0], errors['builtins.Exception'])
+        assert str(results[0]) == "spam&eggs"
+
+        results = [r async for r in client['example.nope']()]
+        assert isinstance(results[0], errors['.NotAMethod'])
+
+
+@pytest.mark.asyncio
+async def test_shoosh(service):
+    async with connect_local(service) as client:
+        gen = client['example.forever']()
+        await gen.__anext__()
+        await gen.aclose()
+        await asyncio.sleep(0.01)
+        async for stats in client['example.stats']():
+            assert stats['channels'] == 1
+
+
+@pytest.mark.asyncio
+async def test_topic(service):
+    topic = service.topic("events")
+    async with connect_local(service) as client:
+        async def collect():
+            return [r async for r in client['example.subscribe']()]
+
+        task = asyncio.create_task(collect())
+        while not len(topic):
+            await asyncio.sleep(0)
+        topic.publish({"line": "spam"})
+        topic.close()
+        assert await task == [{"line": "spam"}]
+
+
+@pytest.mark.asyncio
+async def test_closed(service):
+    client = connect_local(service)
+    await client.close()
+    await client.finished()
+    with pytest.raises(Disconnected):
+        async for result in client['example.Echo']():
+            pass
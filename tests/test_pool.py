@@ -0,0 +1,93 @@
+import asyncio
+from pathlib import Path
+import sys
+
+import pytest
+
+from urp.common import Disconnected
+from urp.pool import SubprocessPool, spawn_pool
+
+SCRIPT = Path(__file__).absolute().parent / "_server_script.py"
+
+
+async def get_pid(pool):
+    async for result in pool['example.pid']():
+        return result['pid']
+
+
+@pytest.mark.asyncio
+async def test_distributes():
+    async with await spawn_pool(sys.executable, SCRIPT, size=2) as pool:
+        results = await asyncio.gather(*(
+            get_pid(pool) for _ in range(4)
+        ))
+        assert len(set(results)) == 2
+
+
+@pytest.mark.asyncio
+async def test_recycle():
+    async with await spawn_pool(sys.executable, SCRIPT, size=1, max_calls=2) as pool:
+        first = await get_pid(pool)
+        assert await get_pid(pool) == first
+        assert await get_pid(pool) != first
+
+
+@pytest.mark.asyncio
+async def test_respawn():
+    async with await spawn_pool(sys.executable, SCRIPT, size=1) as pool:
+        first = await get_pid(pool)
+        with pytest.raises(Disconnected):
+            async for _ in pool['example.crash']():
+                pass
+        assert await get_pid(pool) != first
+
+
+@pytest.mark.asyncio
+async def test_crash_loop():
+    pool = SubprocessPool((sys.executable, '-c', 'raise SystemExit(1)'), size=2)
+    pool.respawn_delay = 0.01
+    pool.max_crashes = 3
+    spawned = 0
+    spawn = pool._spawn
+
+    async def counting_spawn():
+        nonlocal spawned
+        spawned += 1
+        await spawn()
+
+    pool._spawn = counting_spawn
+    async def call_until_failed():
+        while True:
+            try:
+                await get_pid(pool)
+            except Disconnected:
+                # Caught a worker on its way out
+                pass
+
+    async with pool:
+        await pool.start()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(call_until_failed(), 5)
+    # The two initial workers, then no more than max_crashes respawns
+    assert spawned <= 2 + pool.max_crashes
+
+
+@pytest.mark.asyncio
+async def test_spawn_fails():
+    pool = SubprocessPool(('/nonexistent/urp-server',), size=1)
+    pool.respawn_delay = 0.01
+    pool.max_crashes = 2
+    async with pool:
+        # Replace a worker that can't be started again
+        pool._task(pool._respawn())
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(get_pid(pool), 5)
+
+
+@pytest.mark.asyncio
+async def test_max_memory():
+    async with await spawn_pool(sys.executable, SCRIPT, size=1, max_memory=1) as pool:
+        # Run each call to the end, so the worker's memory is checked
+        first, = [r async for r in pool['example.pid']()]
+        second, = [r async for r in pool['example.pid']()]
+        assert first != second
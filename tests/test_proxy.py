@@ -0,0 +1,176 @@
+import asyncio
+import socket
+
+import msgpack
+import pytest
+
+from urp.client import client_from_inherited_socket, errors
+from urp.common import Disconnected
+from urp.framework import Service, method
+from urp.proxy import PacketSplitter, Proxy, split_header
+
+from .utils import aenumerate
+
+
+def make_service(tag):
+    serv = Service(tag)
+
+    @serv.interface(tag)
+    class Example:
+        @method("Echo")
+        def ping(self, **args):
+            return dict(args, server=tag)
+
+        @method
+        async def stream(self):
+            for i in range(3):
+                yield {"i": i}
+
+        @method
+        async def forever(self):
+            await asyncio.Event().wait()
+            yield {}
+
+    return serv
+
+
+@pytest.fixture
+async def proxied():
+    proxy = Proxy()
+    tasks = []
+    for tag in ("spam", "eggs"):
+        bsock, ssock = socket.socketpair()
+        tasks.append(asyncio.create_task(make_service(tag).serve_inherited_socket(ssock)))
+        await proxy.connect_inherited_socket(f"{tag}.", bsock)
+
+    csock, psock = socket.socketpair()
+    tasks.append(asyncio.create_task(proxy.serve_inherited_socket(psock)))
+    client = await client_from_inherited_socket(csock)
+    yield client, proxy
+    await proxy.close()
+    for t in tasks:
+        t.cancel()
+
+
+@pytest.mark.asyncio
+async def test_routing(proxied):
+    client, proxy = proxied
+    async with client:
+        for tag in ("spam", "eggs"):
+            async for i, result in aenumerate(client[f'{tag}.Echo'](a=1)):
+                assert i == 0
+                assert result == {'a': 1, 'server': tag}
+
+
+@pytest.mark.asyncio
+async def test_stream(proxied):
+    client, proxy = proxied
+    async with client:
+        results = [r async for r in client['eggs.stream']()]
+        assert results == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+
+@pytest.mark.asyncio
+async def test_not_a_method(proxied):
+    client, proxy = proxied
+    async with client:
+        async for i, result in aenumerate(client['bacon.Echo']()):
+            assert i == 0
+            assert isinstance(result, errors['.NotAMethod'])
+
+
+@pytest.mark.asyncio
+async def test_shoosh_relayed(proxied):
+    client, proxy = proxied
+    async with client:
+        gen = client['spam.forever']()
+        task = asyncio.create_task(gen.__anext__())
+        await asyncio.sleep(0.1)
+        backend = proxy.route('spam.forever')
+        assert len(backend._channels) == 1
+        task.cancel()
+        await asyncio.sleep(0.1)
+        assert len(backend._channels) == 0
+
+
+@pytest.mark.asyncio
+async def test_backend_lost(proxied):
+    client, proxy = proxied
+    async with client:
+        backend = proxy.route('spam.Echo')
+        backend._transport.close()
+        await backend.finished()
+        results = [r async for r in client['spam.Echo']()]
+        assert isinstance(results[0], errors['.NotAMethod'])
+        results = [r async for r in client['eggs.Echo']()]
+        assert results == [{'server': 'eggs'}]
+
+
+@pytest.mark.asyncio
+async def test_paused_client_lost(proxied):
+    client, proxy = proxied
+    frontend, = proxy._frontends
+    call = asyncio.create_task(client['spam.forever']().__anext__())
+    while not frontend._channels:
+        await asyncio.sleep(0.01)
+    frontend.pause_writing()
+    # Only the backend it has calls on
+    assert proxy.route('spam.Echo')._paused_by == {frontend}
+    assert not proxy.route('eggs.Echo')._paused_by
+    await client.close()
+    with pytest.raises(Disconnected):
+        await call
+    await frontend.finished()
+    assert all(not b._paused_by for b in proxy._backends)
+
+    csock, psock = socket.socketpair()
+    task = asyncio.create_task(proxy.serve_inherited_socket(psock))
+    async with await client_from_inherited_socket(csock) as client:
+        results = [r async for r in client['eggs.Echo']()]
+        assert results == [{'server': 'eggs'}]
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_backend_lost_in_call(proxied):
+    client, proxy = proxied
+    async with client:
+        async def results():
+            return [r async for r in client['spam.forever']()]
+
+        task = asyncio.create_task(results())
+        backend = proxy.route('spam.forever')
+        while not backend._channels:
+            await asyncio.sleep(0.01)
+        backend._transport.close()
+        result, = await task
+        assert isinstance(result, Disconnected)
+
+
+def test_route_cache():
+    proxy = Proxy()
+    backend = object()
+    proxy.add_route("spam.", backend)
+    assert proxy.route("spam.Echo") is backend
+    assert proxy.route("bacon.Echo") is None
+    assert list(proxy._route_cache) == ["spam.Echo"]
+
+
+def test_splitter():
+    packets = [
+        msgpack.packb([1, 1, "spam.Echo", {"x": list(range(100))}]),
+        msgpack.packb("some text"),
+        msgpack.packb([70000, 0]),
+    ]
+    data = b"".join(packets)
+    splitter = PacketSplitter()
+    got = []
+    for i in range(0, len(data), 7):
+        got += splitter.feed(data[i:i + 7])
+    assert got == packets
+
+    prefix, cid, body = split_header(packets[0])
+    assert cid == 1
+    assert body == packets[0][2:]
+    assert split_header(packets[1]) is None
+    assert split_header(packets[2])[1] == 70000
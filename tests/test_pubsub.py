@@ -0,0 +1,94 @@
+import asyncio
+import socket
+
+import pytest
+
+from urp.client import client_from_inherited_socket, errors
+from urp.framework import Service, method
+
+
+@pytest.fixture
+def pubsub_service():
+    serv = Service("urp-test")
+    events = serv.topic("events")
+
+    @serv.interface("example")
+    class Example:
+        @method
+        def subscribe(self):
+            return events.subscribe()
+
+        @method
+        async def subscribe_small(self):
+            return events.subscribe(maxsize=1, on_overflow='disconnect')
+
+    return serv
+
+
+@pytest.fixture
+async def clients(pubsub_service):
+    tasks = []
+    clients = []
+    for _ in range(3):
+        csock, ssock = socket.socketpair()
+        tasks.append(asyncio.create_task(pubsub_service.serve_inherited_socket(ssock)))
+        clients.append(await client_from_inherited_socket(csock))
+    yield clients
+    for client in clients:
+        await client.close()
+    for t in tasks:
+        t.cancel()
+
+
+async def wait_subscribers(topic, count):
+    while len(topic) < count:
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_fanout(pubsub_service, clients):
+    topic = pubsub_service.topic("events")
+
+    async def collect(client):
+        return [r async for r in client['example.subscribe']()]
+
+    tasks = [asyncio.create_task(collect(c)) for c in clients]
+    await wait_subscribers(topic, len(clients))
+    topic.publish({"line": "spam"})
+    topic.publish({"line": "eggs"})
+    topic.close()
+
+    for result in await asyncio.gather(*tasks):
+        assert result == [{"line": "spam"}, {"line": "eggs"}]
+    assert len(topic) == 0
+
+
+@pytest.mark.asyncio
+async def test_unsubscribe(pubsub_service, clients):
+    topic = pubsub_service.topic("events")
+
+    async def collect(client):
+        async for r in client['example.subscribe']():
+            pass
+
+    task = asyncio.create_task(collect(clients[0]))
+    await wait_subscribers(topic, 1)
+    task.cancel()
+    while len(topic):
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_overflow_disconnect(pubsub_service, clients):
+    topic = pubsub_service.topic("events")
+
+    async def collect(client):
+        return [r async for r in client['example.subscribe_small']()]
+
+    task = asyncio.create_task(collect(clients[0]))
+    await wait_subscribers(topic, 1)
+    # Publish faster than the subscriber can be fed
+    for i in range(10):
+        topic.publish({"i": i})
+    result = await task
+    assert isinstance(result[-1], errors['.Overflowed'])
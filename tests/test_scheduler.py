@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from urp.common import Disconnected, OutboundScheduler
+
+
+@pytest.fixture
+def written():
+    return []
+
+
+@pytest.fixture
+def scheduler(written):
+    return OutboundScheduler(written.append)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_passthrough(scheduler, written):
+    await scheduler(0, b'a')
+    await scheduler(1, b'b')
+    assert written == [b'a', b'b']
+
+
+@pytest.mark.asyncio
+async def test_weighted_round_robin(scheduler, written):
+    scheduler.set_weight('bulk', 1)
+    scheduler.set_weight('interactive', 2)
+    scheduler.pause_calls()
+    tasks = [
+        asyncio.create_task(scheduler('bulk', f"b{i}".encode()))
+        for i in range(3)
+    ] + [
+        asyncio.create_task(scheduler('interactive', f"i{i}".encode()))
+        for i in range(3)
+    ]
+    await settle()
+    assert written == []
+
+    scheduler.continue_calls()
+    await asyncio.gather(*tasks)
+    assert written == [b'b0', b'i0', b'i1', b'b1', b'i2', b'b2']
+
+
+@pytest.mark.asyncio
+async def test_only_written_wake(written):
+    scheduler = None
+
+    def write(data):
+        written.append(data)
+        # Transport fills up after each write
+        scheduler.pause_calls()
+
+    scheduler = OutboundScheduler(write)
+    scheduler.pause_calls()
+    tasks = [asyncio.create_task(scheduler(i, b'x')) for i in range(3)]
+    await settle()
+
+    scheduler.continue_calls()
+    await settle()
+    assert [t.done() for t in tasks] == [True, False, False]
+
+    scheduler.continue_calls()
+    scheduler.continue_calls()
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_skipped(scheduler, written):
+    scheduler.pause_calls()
+    task = asyncio.create_task(scheduler(0, b'a'))
+    other = asyncio.create_task(scheduler(1, b'b'))
+    await settle()
+    task.cancel()
+    await settle()
+    scheduler.continue_calls()
+    await other
+    assert written == [b'b']
+
+
+@pytest.mark.asyncio
+async def test_shutdown(scheduler, written):
+    scheduler.pause_calls()
+    task = asyncio.create_task(scheduler(0, b'a'))
+    await settle()
+    scheduler.shutdown(ConnectionResetError())
+    with pytest.raises(Disconnected):
+        await task
+    with pytest.raises(Disconnected):
+        await scheduler(0, b'b')
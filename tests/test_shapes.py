@@ -0,0 +1,112 @@
+import asyncio
+import socket
+
+import pytest
+
+from urp.client import client_from_inherited_socket
+from urp.common import MsgType, ShapeEncoder
+from urp.framework import Service, method
+
+
+@pytest.fixture
+def shape_service():
+    serv = Service("urp-test")
+
+    @serv.interface("example")
+    class Example:
+        @method(shape=("x", "y"))
+        def declared(self):
+            yield {"x": 1, "y": 2}
+            yield {"y": 4, "x": 3}
+            yield {"z": 5}
+
+        @method(shape=("x", "y"))
+        def with_list(self):
+            yield {"x": 1, "y": 2}
+            yield [10, 20, 30]
+            yield {"x": 3, "y": 4}
+
+        @method(shape=True)
+        def inferred_with_list(self):
+            yield {"a": 1}
+            yield [10, 20]
+            yield {"a": 2}
+
+        @method(shape=True)
+        async def inferred(self):
+            yield {"a": 1}
+            yield {"a": 2}
+            yield {"b": 3, "c": 4}
+    return serv
+
+
+@pytest.fixture
+async def linked_pair(shape_service):
+    csock, ssock = socket.socketpair()
+    server_task = asyncio.create_task(shape_service.serve_inherited_socket(ssock))
+    client = await client_from_inherited_socket(csock)
+    yield client, server_task
+    server_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_declared(linked_pair):
+    client, stask = linked_pair
+    async with client:
+        results = [r async for r in client['example.declared']()]
+        assert results == [{"x": 1, "y": 2}, {"x": 3, "y": 4}, {"z": 5}]
+
+
+@pytest.mark.asyncio
+async def test_inferred(linked_pair):
+    client, stask = linked_pair
+    async with client:
+        results = [r async for r in client['example.inferred']()]
+        assert results == [{"a": 1}, {"a": 2}, {"b": 3, "c": 4}]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('name, expected', [
+    ('example.with_list', [{"x": 1, "y": 2}, [10, 20, 30], {"x": 3, "y": 4}]),
+    ('example.inferred_with_list', [{"a": 1}, [10, 20], {"a": 2}]),
+])
+async def test_real_lists(linked_pair, name, expected):
+    client, stask = linked_pair
+    async with client:
+        results = [r async for r in client[name]()]
+        assert results == expected
+
+
+@pytest.mark.asyncio
+async def test_tuples(linked_pair):
+    client, stask = linked_pair
+    async with client:
+        results = [r async for r in client.urp_method('example.declared', tuples=True)()]
+        assert results[0] == (1, 2)
+        assert results[1].x == 3
+        assert results[2] == {"z": 5}
+
+
+@pytest.mark.asyncio
+async def test_not_requested(linked_pair):
+    client, stask = linked_pair
+    async with client:
+        results = [r async for r in client.urp_method('example.inferred', shapes=False)()]
+        assert results == [{"a": 1}, {"a": 2}, {"b": 3, "c": 4}]
+
+
+@pytest.mark.asyncio
+async def test_encoder_packets():
+    sent = []
+
+    async def send(*args):
+        sent.append(args)
+
+    enc = ShapeEncoder(send)
+    await enc({"a": 1})
+    await enc({"a": 2})
+    assert sent == [
+        (MsgType.Shape, ("a",)),
+        (MsgType.Return, [1]),
+        (MsgType.Return, [2]),
+    ]
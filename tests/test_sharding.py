@@ -0,0 +1,127 @@
+import asyncio
+import concurrent.futures
+import socket
+import threading
+
+import pytest
+
+from urp.client import connect_tcp, connect_unix
+from urp.framework import Service, method
+from urp.sharding import SharedCache, _handed_off, tcp_listener
+
+
+@pytest.fixture
+def sharded_service():
+    serv = Service("urp-test")
+    events = serv.topic("events")
+
+    @serv.interface("example")
+    class Example:
+        @method
+        async def thread(self):
+            return threading.get_ident()
+
+        @method
+        def count(self):
+            counter = serv.shared.get_or_create('counter', lambda: [0, threading.Lock()])
+            with counter[1]:
+                counter[0] += 1
+                return counter[0]
+
+        @method
+        def subscribe(self):
+            return events.subscribe()
+
+    return serv
+
+
+@pytest.fixture
+async def clients(sharded_service, tmp_path):
+    path = str(tmp_path / "urp.sock")
+    server = asyncio.create_task(sharded_service.listen_unix(path, loops=3))
+    while not (tmp_path / "urp.sock").exists():
+        await asyncio.sleep(0.01)
+    clients = [await connect_unix(path) for _ in range(6)]
+    yield clients
+    for client in clients:
+        await client.close()
+    server.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await server
+
+
+async def call(client, name):
+    async for r in client[name]():
+        return r
+
+
+@pytest.mark.asyncio
+async def test_spread(clients):
+    idents = [await call(c, 'example.thread') for c in clients]
+    assert len(set(idents)) == 3
+    # Round-robin
+    assert idents[:3] == idents[3:]
+
+
+@pytest.mark.asyncio
+async def test_shared(clients):
+    counts = await asyncio.gather(*(call(c, 'example.count') for c in clients))
+    assert sorted(counts) == list(range(1, len(clients) + 1))
+
+
+@pytest.mark.asyncio
+async def test_publish_across_loops(sharded_service, clients):
+    topic = sharded_service.topic("events")
+
+    async def collect(client):
+        return [r async for r in client['example.subscribe']()]
+
+    tasks = [asyncio.create_task(collect(c)) for c in clients]
+    while len(topic) < len(clients):
+        await asyncio.sleep(0.01)
+    assert sharded_service.stats()['connections'] == len(clients)
+    topic.publish("spam")
+    topic.publish("eggs")
+    topic.close()
+
+    results = await asyncio.gather(*tasks)
+    assert results == [["spam", "eggs"]] * len(clients)
+
+
+def test_shared_cache():
+    cache = SharedCache()
+    made = []
+    assert cache.get_or_create('a', lambda: made.append(1) or 'x') == 'x'
+    assert cache.get_or_create('a', lambda: made.append(1) or 'y') == 'x'
+    assert made == [1]
+    assert 'a' in cache and len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_tcp(sharded_service):
+    sock = tcp_listener('127.0.0.1', 0)
+    port = sock.getsockname()[1]
+    sock.close()
+    server = asyncio.create_task(sharded_service.listen_tcp('127.0.0.1', port, loops=2))
+    for _ in range(100):
+        try:
+            client = await connect_tcp('127.0.0.1', port)
+        except OSError:
+            await asyncio.sleep(0.01)
+        else:
+            break
+    async with client:
+        assert await call(client, 'example.count') == 1
+    server.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await server
+
+
+def test_failed_handoff(caplog):
+    conn, other = socket.socketpair()
+    fut = concurrent.futures.Future()
+    fut.add_done_callback(_handed_off(conn))
+    fut.set_exception(OSError("spam"))
+    assert conn.fileno() == -1
+    assert "spam" in caplog.text
+    other.close()
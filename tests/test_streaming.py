@@ -0,0 +1,104 @@
+import asyncio
+import socket
+
+import pytest
+
+from urp.client import Stream, client_from_inherited_socket, errors
+from urp.framework import Service, method
+from urp.local import connect_local
+from urp.server import ServerBaseProtocol
+
+
+@pytest.fixture
+def service():
+    serv = Service("urp-test")
+
+    @serv.interface("example")
+    class Example:
+        @method
+        async def upload(self, name, chunks):
+            total = 0
+            async for chunk in chunks:
+                total += len(chunk)
+            return {"name": name, "total": total}
+
+        @method
+        async def echo(self, values):
+            async for value in values:
+                yield {"value": value}
+
+        @method
+        async def slow(self, values):
+            async for value in values:
+                await asyncio.sleep(0.01)
+            return {}
+
+    return serv
+
+
+@pytest.fixture
+async def client(service):
+    csock, ssock = socket.socketpair()
+    server_task = asyncio.create_task(service.serve_inherited_socket(ssock))
+    client = await client_from_inherited_socket(csock)
+    async with client:
+        yield client
+    server_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_upload(client):
+    chunks = [b"x" * 1000 for _ in range(100)]
+    results = [r async for r in client['example.upload'](name="spam", chunks=Stream(chunks))]
+    assert results == [{"name": "spam", "total": 100000}]
+
+
+@pytest.mark.asyncio
+async def test_empty(client):
+    results = [r async for r in client['example.upload'](name="spam", chunks=Stream([]))]
+    assert results == [{"name": "spam", "total": 0}]
+
+
+@pytest.mark.asyncio
+async def test_bidirectional(client):
+    async def values():
+        for i in range(40):
+            yield i
+
+    results = [r async for r in client['example.echo'](values=Stream(values()))]
+    assert results == [{"value": i} for i in range(40)]
+
+
+@pytest.mark.asyncio
+async def test_backpressure(client):
+    sent = 0
+
+    def values():
+        nonlocal sent
+        for i in range(100):
+            sent += 1
+            yield i
+
+    task = asyncio.create_task(client['example.slow'](values=Stream(values())).__anext__())
+    await asyncio.sleep(0.05)
+    # Only about a window ahead of the method
+    assert sent <= ServerBaseProtocol.urp_stream_window + 10
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_iterable_error(client):
+    def values():
+        yield 1
+        raise KeyError("boom")
+
+    with pytest.raises(KeyError):
+        async for r in client['example.echo'](values=Stream(values())):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_local(service):
+    async with connect_local(service) as client:
+        results = [r async for r in client['example.echo'](values=Stream(range(3)))]
+        assert results == [{"value": i} for i in range(3)]
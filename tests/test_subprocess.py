@@ -1,9 +1,11 @@
+import fcntl
 from pathlib import Path
 import sys
 
 import pytest
 
 from urp.client import spawn_server
+from urp.common import F_SETPIPE_SZ, PIPE_SIZE, WriteBufferTuner
 
 from .utils import aenumerate
 
@@ -23,3 +25,37 @@ async def test_subprocess(stdio_client):
             assert i == 0
             assert result == {'spam': 'eggs'}
 
+
+
+@pytest.mark.asyncio
+async def test_large_payload(stdio_client):
+    payload = "x" * (4 * 1024 * 1024)
+    async with stdio_client:
+        async for i, result in aenumerate(stdio_client['example.Echo'](data=payload)):
+            assert i == 0
+            assert result == {'data': payload}
+
+
+@pytest.mark.skipif(F_SETPIPE_SZ is None, reason="Linux only")
+@pytest.mark.asyncio
+async def test_pipe_size(stdio_client):
+    stdin = stdio_client._transport.get_pipe_transport(0).get_extra_info('pipe')
+    assert fcntl.fcntl(stdin.fileno(), F_SETPIPE_SZ + 1) == PIPE_SIZE  # F_GETPIPE_SZ
+
+
+def test_tuner():
+    class Transport:
+        limits = (16 * 1024, 64 * 1024)
+
+        def get_write_buffer_limits(self):
+            return self.limits
+
+        def set_write_buffer_limits(self, high, low):
+            self.limits = (low, high)
+
+    trans = Transport()
+    tuner = WriteBufferTuner(trans, target_latency=1)
+    # Drains instantly, so grow (but only double)
+    tuner.paused()
+    tuner.resumed()
+    assert trans.limits == (32 * 1024, 128 * 1024)
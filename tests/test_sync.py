@@ -0,0 +1,77 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+from urp.client import errors
+from urp.framework import Service, method
+from urp.sync import SyncClient
+
+
+@pytest.fixture
+def sync_client():
+    serv = Service("urp-test")
+
+    @serv.interface("example")
+    class Example:
+        @method("Echo")
+        def ping(self, **args):
+            return args
+
+        @method
+        def gen(self):
+            for i in range(3):
+                yield {"i": i}
+
+        @method(shape=True)
+        def shaped(self):
+            for i in range(3):
+                yield {"i": i}
+
+        @method
+        async def forever(self):
+            while True:
+                yield {}
+                await asyncio.sleep(0.01)
+
+        @method
+        def error(self, msg):
+            raise Exception(msg)
+
+    csock, ssock = socket.socketpair()
+    thread = threading.Thread(
+        target=asyncio.run, args=(serv.serve_inherited_socket(ssock),),
+        daemon=True,
+    )
+    thread.start()
+    with SyncClient(csock) as client:
+        yield client
+    thread.join(5)
+
+
+def test_call(sync_client):
+    assert sync_client.call('example.Echo', spam='eggs') == {'spam': 'eggs'}
+
+
+def test_stream(sync_client):
+    assert list(sync_client['example.gen']()) == [{"i": 0}, {"i": 1}, {"i": 2}]
+    assert list(sync_client['example.shaped']()) == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+
+def test_abandon(sync_client):
+    for result in sync_client['example.gen']():
+        break
+    assert sync_client.call('example.Echo', spam='eggs') == {'spam': 'eggs'}
+
+
+def test_error(sync_client):
+    with pytest.raises(errors['builtins.Exception']):
+        sync_client.call('example.error', msg="spam&eggs")
+    with pytest.raises(errors['.NotAMethod']):
+        sync_client.call('example.nope')
+
+
+def test_call_first(sync_client):
+    assert sync_client.call('example.forever') == {}
+    assert sync_client.call('example.Echo', spam='eggs') == {'spam': 'eggs'}
@@ -0,0 +1,171 @@
+import asyncio
+import socket
+import sys
+import threading
+import typing
+
+import pytest
+
+from urp.client import Stream, client_from_inherited_socket, errors
+from urp.common import MsgType
+from urp.framework import Service, method
+from urp.local import connect_local
+from urp.validation import compile_validator
+
+
+class Example:
+    def plain(self, a, b=1, *, c):
+        pass
+
+    def typed(self, n: int, x: float, name: typing.Optional[str] = None,
+              items: typing.List[int] = ()):
+        pass
+
+    def anything(self, a, **rest):
+        pass
+
+
+def test_compile():
+    validate = compile_validator(Example.plain)
+    assert validate({'a': 1, 'c': 2}) is None
+    assert validate({'a': 1, 'b': 2, 'c': 3}) is None
+    problem = validate({'b': 2, 'd': 3})
+    assert problem['missing'] == ['a', 'c']
+    assert problem['unexpected'] == ['d']
+    assert 'msg' in problem
+    assert validate({'c': 2}, supplied=('a',)) is None
+    assert validate([1, 2])['msg']
+
+
+def test_annotations():
+    validate = compile_validator(Example.typed)
+    assert validate({'n': 1, 'x': 2}) is None
+    assert validate({'n': 1, 'x': 2.5, 'name': None, 'items': [1]}) is None
+    problem = validate({'n': "1", 'x': 2, 'name': 3, 'items': {}})
+    assert problem['invalid'] == {'n': 'int', 'name': 'str or nil', 'items': 'list'}
+
+
+@pytest.mark.skipif(sys.version_info < (3, 9), reason="Needs builtin generics")
+def test_builtin_generics():
+    def func(self, items: list[int], names: typing.Optional[dict[str, int]] = None):
+        pass
+
+    validate = compile_validator(func)
+    assert validate({'items': [1], 'names': {}}) is None
+    assert validate({'items': {}, 'names': []})['invalid'] == {
+        'items': 'list', 'names': 'dict or nil',
+    }
+
+
+def test_arrays_as_lists():
+    def func(self, a: tuple, b: typing.Tuple[int, ...], c: typing.FrozenSet[str]):
+        pass
+
+    validate = compile_validator(func)
+    # msgpack gives arrays as lists
+    assert validate({'a': [1], 'b': [2], 'c': ["x"]}) is None
+    assert validate({'a': {}, 'b': [], 'c': []})['invalid'] == {'a': 'tuple'}
+
+
+def test_var_keyword():
+    validate = compile_validator(Example.anything)
+    assert validate({'a': 1, 'z': 2}) is None
+    assert validate({'z': 2})['missing'] == ['a']
+
+
+@pytest.fixture
+def service():
+    serv = Service("urp-test")
+
+    @serv.interface("example")
+    class Example:
+        @method
+        def add(self, a: int, b: int):
+            return {'sum': a + b}
+
+        @method
+        async def total(self, values):
+            return {'sum': sum([v async for v in values])}
+
+    return serv
+
+
+def test_index_threads(service):
+    # Every thread should see the whole index, never a partial one
+    results = []
+    barrier = threading.Barrier(8)
+
+    def check():
+        barrier.wait()
+        results.append(service._check_call('example.total', {'values': 1}))
+
+    threads = [threading.Thread(target=check) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [None] * 8
+
+
+@pytest.fixture
+async def linked_pair(service):
+    csock, ssock = socket.socketpair()
+    task = asyncio.create_task(service.serve_inherited_socket(ssock))
+    client = await client_from_inherited_socket(csock)
+    yield client, service
+    await client.close()
+    task.cancel()
+
+
+async def call(client, name, **args):
+    return [r async for r in client[name](**args)]
+
+
+@pytest.mark.asyncio
+async def test_rejected(linked_pair):
+    client, service = linked_pair
+    assert await call(client, 'example.add', a=1, b=2) == [{'sum': 3}]
+
+    results = await call(client, 'example.add', a=1, c=2)
+    assert len(results) == 1
+    assert isinstance(results[0], errors['.InvalidParameters'])
+    assert results[0].missing == ['b']
+    assert results[0].unexpected == ['c']
+
+    results = await call(client, 'example.add', a=1, b="2")
+    assert results[0].invalid == {'b': 'int'}
+
+    results = await call(client, 'example.nope')
+    assert isinstance(results[0], errors['.NotAMethod'])
+
+    # Nothing was left behind for the bad calls
+    assert service.stats()['channels'] == 0
+
+
+@pytest.mark.asyncio
+async def test_short_call(linked_pair):
+    client, service = linked_pair
+    for packet, error in [
+        ([MsgType.Call, 'example.add'], '.InvalidParameters'),
+        ([MsgType.Call], '.NotAMethod'),
+    ]:
+        with client.urp_open_channel() as (send, queue):
+            await send(*packet)
+            msg = await asyncio.wait_for(queue.get(), 5)
+            assert msg[:2] == [MsgType.Error, error]
+            assert (await queue.get())[0] == MsgType.Shoosh
+
+
+@pytest.mark.asyncio
+async def test_streamed_parameter(linked_pair):
+    client, service = linked_pair
+    assert await call(client, 'example.total', values=Stream(range(4))) == [{'sum': 6}]
+    results = await call(client, 'example.add', a=1, b=2, c=Stream(range(4)))
+    assert results[0].unexpected == ['c']
+
+
+@pytest.mark.asyncio
+async def test_local(service):
+    async with connect_local(service) as client:
+        results = await call(client, 'example.add', a=1)
+        assert results[0].missing == ['b']
@@ -0,0 +1,94 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from urp.client import client_from_inherited_socket
+from urp.framework import Service, method
+from urp.watchdog import Stall, StallWatchdog
+
+
+@pytest.fixture
+def blocking_service():
+    serv = Service("urp-test")
+    serv.stall_threshold = 0.05
+
+    @serv.interface("example")
+    class Example:
+        @method
+        def block(self):
+            time.sleep(0.3)
+            return {}
+
+        @method
+        async def async_block(self):
+            await asyncio.sleep(0)
+            time.sleep(0.3)
+            return {}
+
+    return serv
+
+
+@pytest.fixture
+async def linked_pair(blocking_service):
+    csock, ssock = socket.socketpair()
+    task = asyncio.create_task(blocking_service.serve_inherited_socket(ssock))
+    client = await client_from_inherited_socket(csock)
+    while not blocking_service._connections:
+        await asyncio.sleep(0.01)
+    server, = blocking_service._connections
+    yield client, server
+    await client.close()
+    task.cancel()
+
+
+async def wait_stalls(proto, count):
+    for _ in range(100):
+        if len(proto.urp_stalls) >= count:
+            break
+        await asyncio.sleep(0.01)
+    return list(proto.urp_stalls)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('name', ['example.block', 'example.async_block'])
+async def test_method_stall(linked_pair, name, caplog):
+    client, server = linked_pair
+    async for _ in client[name]():
+        pass
+    stall, = await wait_stalls(server, 1)
+    assert stall.method == name
+    assert stall.duration >= 0.2
+    assert any('time.sleep' in line for line in stall.stack)
+    assert name in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_client_stall():
+    csock, ssock = socket.socketpair()
+    client = await client_from_inherited_socket(csock)
+    dog = client.urp_watch_stalls(0.05)
+    time.sleep(0.2)
+    stall, = await wait_stalls(client, 1)
+    assert stall.method is None
+    assert dog.stalls[-1] is stall
+
+    await client.close()
+    ssock.close()
+    await client.finished()
+    assert not dog.listeners
+
+
+@pytest.mark.asyncio
+async def test_stale_stall():
+    dog = StallWatchdog(asyncio.get_running_loop(), threshold=10)
+    dog.start()
+    try:
+        # A stall caught for a beat before the latest one
+        await asyncio.sleep(0)
+        dog._pending = Stall(dog._last - 1, None, [])
+        dog._beat()
+        assert not dog.stalls
+    finally:
+        dog.stop()
@@ -0,0 +1,45 @@
+import asyncio
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+from urp.zygote import spawn_zygote
+
+from .utils import aenumerate
+
+SCRIPT = Path(__file__).absolute().parent / "_server_script.py"
+
+# Cumulative microseconds `import urp.sync` may take
+IMPORT_BUDGET = 150_000
+
+
+@pytest.mark.asyncio
+async def test_zygote():
+    async with await spawn_zygote(sys.executable, SCRIPT) as zygote:
+        clients = await asyncio.gather(zygote.spawn(), zygote.spawn())
+        pids = set()
+        for client in clients:
+            async with client:
+                async for i, result in aenumerate(client['example.pid']()):
+                    assert i == 0
+                    pids.add(result['pid'])
+        assert len(pids) == 2
+        assert zygote.process.pid not in pids
+
+
+def test_import_budget():
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import urp, urp.sync'],
+        capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+
+    assert 'asyncio' not in times
+    assert times['urp'] + times['urp.sync'] < IMPORT_BUDGET
@@ -1,3 +1,48 @@
-from .client import *  # noqa
-from .framework import *  # noqa
-from .common import Disconnected
+"""
+Unnamed RPC Protocol.
+
+Submodules are only imported when one of their names is first used, so that
+eg urp.sync can be used without pulling in asyncio.
+"""
+import importlib
+
+_exports = {
+    'errors': 'client',
+    'connect_tcp': 'client',
+    'connect_unix': 'client',
+    'client_from_inherited_fd': 'client',
+    'client_from_stdio': 'client',
+    'client_from_inherited_socket': 'client',
+    'spawn_server': 'client',
+    'Stream': 'client',
+    'method': 'framework',
+    'Service': 'framework',
+    'SubprocessPool': 'pool',
+    'spawn_pool': 'pool',
+    'HedgedClient': 'hedge',
+    'Proxy': 'proxy',
+    'LocalClient': 'local',
+    'connect_local': 'local',
+    'Zygote': 'zygote',
+    'spawn_zygote': 'zygote',
+    'Topic': 'pubsub',
+    'Disconnected': 'codec',
+    'register_ext_type': 'codec',
+    'register_error': 'codec',
+}
+
+__all__ = tuple(_exports)
+
+
+def __getattr__(name):
+    try:
+        modname = _exports[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(f".{modname}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
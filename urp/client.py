@@ -1,49 +1,37 @@
 import asyncio
-import collections
 import socket
 import sys
-import types
 
+from .codec import ApplicationError, Stream, errors, get_error  # noqa: F401
 from .common import (
     MsgType, BaseUrpProtocol, UrpStreamMixin, UrpSubprocessMixin,
-    connect_fd, connect_stdio, Disconnected,
+    ShapeDecoder, connect_fd, connect_stdio, tune_pipes, Disconnected,
 )
 
 __all__ = (
     'errors', 'connect_tcp', 'connect_unix', 'client_from_inherited_fd',
     'client_from_stdio', 'client_from_inherited_socket', 'spawn_server',
+    'Stream',
 )
 
 
-class ApplicationError(Exception):
+async def _pump(send, iterable, credit):
     """
-    Base exception for exceptions sent over the wire.
+    Streams the items of an iterable to a channel, as the server grants credit.
     """
-
-
-class _ErrorCache(collections.defaultdict):
-    def __missing__(self, key):
-        self[key] = types.new_class(key, (ApplicationError,))
-        return self[key]
-
-
-errors = _ErrorCache()
-
-
-def get_error(name, additional):
-    """
-    Gets an error instance for the given name and additional
-    """
-    if additional is None:
-        return errors[name]()
-    elif isinstance(additional, dict):
-        err = errors[name](additional.pop('msg'))
-        vars(err).update(additional)
-        return err
-    elif isinstance(additional, list):
-        return errors[name](*additional)
+    # Nothing can go until the server's ready for it, not even the DataEnd of
+    # an empty stream
+    await credit.acquire()
+    credit.release()
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            await credit.acquire()
+            await send(MsgType.Data, item)
     else:
-        return errors[name](additional)
+        for item in iterable:
+            await credit.acquire()
+            await send(MsgType.Data, item)
+    await send(MsgType.DataEnd)
 
 
 class ClientBaseProtocol(BaseUrpProtocol):
@@ -53,29 +41,82 @@ class ClientBaseProtocol(BaseUrpProtocol):
 
         Methods take keyword arguments and produce a sequence of returns and errors
         """
+        return self.urp_method(key)
+
+    def urp_method(self, key, *, shapes=True, tuples=False, priority=None):
+        """
+        Gets a method, with options.
+
+        If shapes is set, the server may send returns as compacted positional
+        arrays (if the method is declared with a shape). If tuples is also set,
+        these are given as namedtuples instead of dicts.
+
+        priority overrides the method's weight on congested connections, in
+        both directions.
+        """
+        options = {'shapes': True} if shapes else {}
+        if priority is not None:
+            options['priority'] = priority
+
         async def call_method(**args):
             # TODO: Logging
-            with self.urp_open_channel() as (send, queue):
-                await send(MsgType.Call, key, args, 999)  # TODO (999 == log level)
+            decoder = ShapeDecoder(tuples)
+            call_options = options
+            streams = [k for k, v in args.items() if isinstance(v, Stream)]
+            if len(streams) > 1:
+                raise ValueError("Only one argument may be streamed")
+            elif streams:
+                stream = args[streams[0]]
+                args = {k: v for k, v in args.items() if k != streams[0]}
+                call_options = dict(options, stream=streams[0])
+
+            with self.urp_open_channel(priority=priority) as (send, queue):
+                await send(MsgType.Call, key, args, 999, call_options)  # TODO (999 == log level)
+                pump = None
+                credit = asyncio.Semaphore(0)
+                if streams:
+                    pump = self._urp_task(_pump(send, stream.iterable, credit))
+                    pump.add_done_callback(
+                        lambda t: t.cancelled() or t.exception() is None or queue.put_nowait(t))
+                # Whether the channel ended from the other side
+                ended = False
                 try:
                     while True:
                         msg = await queue.get()
-                        if isinstance(msg, Exception):
+                        if pump is not None and msg is pump:
+                            # Raise the iterable's error
+                            msg.result()
+                        elif isinstance(msg, Exception):
+                            ended = True
                             raise msg
                         elif msg is None:
+                            ended = True
                             raise Disconnected
                         elif msg[0] == MsgType.Shoosh:
+                            ended = True
                             return
                         elif msg[0] == MsgType.Return:
-                            yield msg[1]
+                            yield decoder(msg[1])
+                        elif msg[0] == MsgType.Shape:
+                            decoder.set_shape(msg[1])
+                        elif msg[0] == MsgType.Credit:
+                            for _ in range(msg[1]):
+                                credit.release()
                         elif msg[0] == MsgType.Error:
                             yield get_error(msg[1], msg[2])
                         elif msg[0] == MsgType.Log:
                             # TODO
                             ...
-                except asyncio.CancelledError:
-                    send(MsgType.Shoosh)
-                    raise
+                finally:
+                    if pump is not None:
+                        pump.cancel()
+                        await asyncio.gather(pump, return_exceptions=True)
+                    # Cancelled or abandoned
+                    if not ended:
+                        try:
+                            await send(MsgType.Shoosh)
+                        except Disconnected:
+                            pass
 
         return call_method
 
@@ -124,22 +165,27 @@ async def connect_unix(path, **opts):
     return proto
 
 
-async def client_from_inherited_fd(reader_fd, writer_fd):
+async def client_from_inherited_fd(reader_fd, writer_fd, **tuning):
     """
     Connect via reader and writer file descriptors.
+
+    tuning is passed to tune_pipes().
     """
     return await connect_fd(
         lambda: ClientStreamProtocol(),
-        reader_fd, writer_fd
+        reader_fd, writer_fd, **tuning
     )
 
 
-async def client_from_stdio():
+async def client_from_stdio(**tuning):
     """
     Connect via our stdin and stdout.
+
+    tuning is passed to tune_pipes().
     """
     return await connect_stdio(
         lambda: ClientStreamProtocol(),
+        **tuning
     )
 
 
@@ -160,16 +206,21 @@ async def client_from_inherited_socket(sock_fd, **opts):
     return proto
 
 
-async def spawn_server(*cmd):
+async def spawn_server(*cmd, **tuning):
     """
     Run a subprocess on the assumption it will serve on stdio and connect a
     client to it.
+
+    tuning is passed to tune_pipes().
     """
-    
     loop = asyncio.get_running_loop()
-    _, protocol = await loop.subprocess_exec(
+    transport, protocol = await loop.subprocess_exec(
         ClientSubprocessProtocol,
         *cmd,
     )
+    tune_pipes(
+        protocol, transport.get_pipe_transport(1), transport.get_pipe_transport(0),
+        **tuning
+    )
 
     return protocol
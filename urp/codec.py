@@ -0,0 +1,456 @@
+"""
+The wire format, shared by the async and sync implementations.
+
+Kept free of asyncio so it's cheap to import.
+"""
+import array
+import builtins
+import collections
+import datetime
+import enum
+import functools
+import sys
+import types
+import uuid
+
+import msgpack
+
+
+
+class MsgType(enum.IntEnum):
+    Shoosh = 0  # (Any): ()
+
+    Call = 1  # (C2S): name, params, log, options
+    Return = 2  # (S2C): value
+    Error = 3  # (S2C): name, additional
+
+    Log = 4  # (S2C): group, level, msg
+
+    Shape = 5  # (S2C): keys
+
+    Data = 6  # (C2S): value
+    DataEnd = 7  # (C2S): ()
+    Credit = 8  # (S2C): count
+
+
+class LogLevels(enum.IntEnum):
+    Trace = 0
+    Debug = 10
+    Verbose = 20
+    Info = 30
+    Warning = 40
+    Error = 50
+    Critical = 60
+
+# TODO: Write functions to go between python and urp log levels.
+
+
+class Disconnected(Exception):
+    """
+    Not currently connected to the server
+    """
+
+
+class ApplicationError(Exception):
+    """
+    Base exception for exceptions sent over the wire.
+    """
+
+
+@functools.lru_cache(maxsize=1024)
+def _fqn(cls):
+    fullname = ""
+    if cls.__module__:
+        fullname = cls.__module__ + "."
+    if hasattr(cls, '__qualname__'):
+        fullname += cls.__qualname__
+    else:
+        fullname += cls.__name__
+    return fullname
+
+
+def _build(cls, args):
+    """
+    Makes an exception from its args. Plenty of exceptions take different
+    arguments than they pass on to Exception, so if the args don't fit, it's
+    made without calling __init__ (and the attributes are filled in after).
+    """
+    try:
+        return cls(*args)
+    except TypeError:
+        err = cls.__new__(cls)
+        err.args = tuple(args)
+        return err
+
+
+class ErrorRegistry:
+    """
+    Maps error names on the wire to local exception classes, and back.
+
+    Registered names map to their class. Other names get a synthesized
+    ApplicationError subclass, of which only the maxsize most recently used
+    are kept (so an evicted name gets a new class next time).
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._by_name = {}
+        self._by_class = {}
+        self._synthesized = collections.OrderedDict()
+
+    def register(self, name, cls=None, encode=None):
+        """
+        errors.register("example.Spam", SpamError)
+
+        @errors.register("example.Spam")
+        class SpamError(Exception): ...
+
+        Use cls for errors with the given name, and the name for instances of
+        cls (and its subclasses) raised by methods. encode(exc), if given,
+        produces the additional data instead of the default of args, msg, and
+        the instance's attributes.
+        """
+        def _(cls):
+            self._by_name[name] = cls
+            self._by_class[cls] = name, encode
+            self._synthesized.pop(name, None)
+            return cls
+
+        if cls is None:
+            return _
+        else:
+            return _(cls)
+
+    def __getitem__(self, name):
+        try:
+            return self._by_name[name]
+        except KeyError:
+            pass
+        try:
+            self._synthesized.move_to_end(name)
+            return self._synthesized[name]
+        except KeyError:
+            cls = self._synthesized[name] = types.new_class(name, (ApplicationError,))
+            if len(self._synthesized) > self.maxsize:
+                self._synthesized.popitem(last=False)
+            return cls
+
+    def __contains__(self, name):
+        return name in self._by_name or name in self._synthesized
+
+    def instantiate(self, name, additional):
+        """
+        Gets an error instance for the given name and additional
+        """
+        cls = self[name]
+        if additional is None:
+            return _build(cls, ())
+        elif isinstance(additional, dict):
+            attrs = dict(additional)
+            msg = attrs.pop('msg', None)
+            args = attrs.pop('args', None)
+            if name in self._by_name and args is not None:
+                # A real class, so rebuild it properly
+                err = _build(cls, args)
+            elif msg is not None:
+                err = _build(cls, (msg,))
+            else:
+                err = _build(cls, ())
+            vars(err).update(attrs)
+            return err
+        elif isinstance(additional, list):
+            return _build(cls, additional)
+        else:
+            return _build(cls, (additional,))
+
+    def serialize(self, exc):
+        """
+        Gives the name and additional data to send for an exception.
+        """
+        for cls in type(exc).__mro__:
+            if cls in self._by_class:
+                name, encode = self._by_class[cls]
+                break
+        else:
+            name, encode = _fqn(type(exc)), None
+
+        if encode is not None:
+            return name, encode(exc)
+        additional = {
+            'args': exc.args,
+            'msg': str(exc),
+        }
+        additional.update(vars(exc))
+        return name, additional
+
+
+errors = ErrorRegistry()
+errors.register('.Disconnected', Disconnected)
+
+
+def register_error(name, cls=None, encode=None):
+    """
+    Register an error name for all connections. See ErrorRegistry.register().
+    """
+    return errors.register(name, cls, encode)
+
+
+def get_error(name, additional):
+    """
+    Gets an error instance for the given name and additional
+    """
+    return errors.instantiate(name, additional)
+
+
+class Stream:
+    """
+    Wraps an iterable or async iterable passed as a call argument, so that its
+    items are streamed to the method after the call starts instead of being
+    sent with it.
+    """
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+
+
+class ExtRegistry:
+    """
+    Maps Python types to msgpack extension types and back.
+
+    Codes 0-119 are for applications; 120-127 are used by the built-in codecs.
+    """
+
+    def __init__(self):
+        self._by_type = {}
+        self._by_code = {}
+
+    def register(self, code, type, encode, decode):
+        """
+        Register a codec. encode(obj) gives bytes, decode(data) gives an object.
+        If decode() fails, the value is received as a msgpack.ExtType.
+
+        Subclasses of type are also encoded with it. type may be given as a
+        dotted name, to avoid importing it before it's used.
+        """
+        if not 0 <= code <= 127:
+            raise ValueError("Extension type codes must be 0-127")
+        self._by_type[type] = code, encode
+        self._by_code[code] = decode
+
+    def unregister(self, code):
+        """
+        Remove the codec for the given code.
+        """
+        self._by_code.pop(code, None)
+        for type, (tcode, _) in list(self._by_type.items()):
+            if tcode == code:
+                del self._by_type[type]
+
+    def default(self, obj):
+        for cls in builtins.type(obj).__mro__:
+            codec = (
+                self._by_type.get(cls)
+                or self._by_type.get(f"{cls.__module__}.{cls.__qualname__}")
+            )
+            if codec is not None:
+                code, encode = codec
+                return msgpack.ExtType(code, encode(obj))
+        raise TypeError(f"Cannot serialize {obj!r}")
+
+    def ext_hook(self, code, data):
+        decode = self._by_code.get(code)
+        if decode is None:
+            return msgpack.ExtType(code, data)
+        try:
+            return decode(data)
+        except Exception:
+            # Malformed, but that's no reason to break the connection
+            return msgpack.ExtType(code, data)
+
+
+#: The registry used by all connections
+ext_types = ExtRegistry()
+
+
+def register_ext_type(code, type, encode, decode):
+    """
+    Register a msgpack extension type for all connections, client and server.
+
+    See ExtRegistry.register().
+    """
+    ext_types.register(code, type, encode, decode)
+
+
+# Aware datetimes use msgpack's own Timestamp; naive ones can't.
+def _encode_naive_datetime(dt):
+    if dt.tzinfo is not None:
+        raise TypeError("Aware datetimes should be packed as Timestamps")
+    return dt.isoformat().encode('ascii')
+
+
+def _decode_naive_datetime(data):
+    return datetime.datetime.fromisoformat(data.decode('ascii'))
+
+
+# Arrays are sent as their raw (little-endian) buffer, and received as a
+# memoryview over the received bytes. (Note that msgpack sends memoryviews
+# themselves as plain bin, so copy back into an array to forward one.)
+# The array type codes sent on the wire, by item size. Others (like l, whose
+# size differs between platforms) are sent as the one of the same size.
+_ARRAY_SIZES = {
+    'b': 1, 'B': 1, 'h': 2, 'H': 2, 'i': 4, 'I': 4, 'q': 8, 'Q': 8,
+    'f': 4, 'd': 8,
+}
+_ARRAY_ALIASES = {'l': 'iq', 'L': 'IQ'}
+
+
+def _encode_array(arr):
+    typecode = arr.typecode
+    for code in _ARRAY_ALIASES.get(typecode, typecode):
+        if _ARRAY_SIZES.get(code) == arr.itemsize:
+            break
+    else:
+        raise TypeError(f"Cannot serialize arrays of type {typecode!r}")
+    if sys.byteorder == 'big':
+        arr = array.array(typecode, arr)
+        arr.byteswap()
+    return code.encode('ascii') + arr.tobytes()
+
+
+def _decode_array(data):
+    typecode = chr(data[0])
+    size = _ARRAY_SIZES.get(typecode)
+    if (size is None or array.array(typecode).itemsize != size
+            or (len(data) - 1) % size):
+        # Not something we can make sense of, but don't break the connection
+        return msgpack.ExtType(122, data)
+    if sys.byteorder == 'big':
+        arr = array.array(typecode, data[1:])
+        arr.byteswap()
+        return memoryview(arr)
+    return memoryview(data)[1:].cast(typecode)
+
+
+# NumPy is optional, and only imported once an ndarray is received.
+def _encode_ndarray(arr):
+    import numpy
+    if arr.dtype.hasobject:
+        raise TypeError("Cannot serialize object arrays")
+    # ascontiguousarray() makes 0-d arrays 1-d, so take the shape first
+    shape = arr.shape
+    arr = numpy.ascontiguousarray(arr)
+    header = f"{arr.dtype.str}|{','.join(map(str, shape))}".encode('ascii')
+    return bytes([len(header)]) + header + arr.data.cast('B')
+
+
+def _decode_ndarray(data):
+    import numpy
+    hlen = data[0]
+    dtype, shape = data[1:1 + hlen].decode('ascii').split('|')
+    shape = tuple(int(n) for n in shape.split(',') if n)
+    # Read-only, sharing memory with data
+    return numpy.frombuffer(data, dtype=dtype, offset=1 + hlen).reshape(shape)
+
+
+ext_types.register(120, datetime.datetime, _encode_naive_datetime, _decode_naive_datetime)
+ext_types.register(121, uuid.UUID, lambda u: u.bytes, lambda data: uuid.UUID(bytes=data))
+ext_types.register(122, array.array, _encode_array, _decode_array)
+ext_types.register(123, 'numpy.ndarray', _encode_ndarray, _decode_ndarray)
+
+
+def make_packer():
+    """
+    Makes a Packer for producing packets.
+    """
+    return msgpack.Packer(autoreset=True, datetime=True, default=ext_types.default)
+
+
+def make_unpacker():
+    """
+    Makes a streaming Unpacker for consuming packets.
+    """
+    return msgpack.Unpacker(raw=False, timestamp=3, ext_hook=ext_types.ext_hook)
+
+
+def packb(obj):
+    """
+    Serialize a single value, like a connection would.
+    """
+    return make_packer().pack(obj)
+
+
+def unpackb(data):
+    """
+    Deserialize a single value, like a connection would.
+    """
+    return msgpack.unpackb(data, raw=False, timestamp=3, ext_hook=ext_types.ext_hook)
+
+
+class ShapeEncoder:
+    """
+    Sends Return values, compacting maps with a known set of keys into
+    positional arrays.
+
+    shape is either a sequence of keys (declared by the method) or True (infer
+    from the values as they come, re-announcing when the keys change).
+    """
+
+    def __init__(self, send, shape=True):
+        self._send = send
+        self._infer = shape is True
+        self._keys = None if self._infer else tuple(shape)
+        self._keyset = None if self._infer else frozenset(self._keys)
+        self._announced = False
+
+    async def __call__(self, value):
+        if not isinstance(value, dict):
+            if isinstance(value, (list, tuple)) and self._announced:
+                # Would be read as positional, so drop the shape first
+                await self._send(MsgType.Shape, None)
+                self._announced = False
+                if self._infer:
+                    self._keys = None
+            await self._send(MsgType.Return, value)
+        elif self._infer:
+            keys = tuple(value)
+            if keys != self._keys:
+                self._keys = keys
+                self._announced = True
+                await self._send(MsgType.Shape, keys)
+            await self._send(MsgType.Return, list(value.values()))
+        elif value.keys() == self._keyset:
+            if not self._announced:
+                self._announced = True
+                await self._send(MsgType.Shape, self._keys)
+            await self._send(MsgType.Return, [value[k] for k in self._keys])
+        else:
+            # Doesn't fit the declared shape, send it the long way
+            await self._send(MsgType.Return, value)
+
+
+class ShapeDecoder:
+    """
+    Rehydrates Return values sent by a ShapeEncoder, either into dicts or (if
+    tuples is set) into namedtuples.
+    """
+
+    def __init__(self, tuples=False):
+        self._tuples = tuples
+        self._keys = None
+        self._cls = None
+
+    def set_shape(self, keys):
+        if keys is None:
+            self._keys = self._cls = None
+            return
+        self._keys = tuple(keys)
+        if self._tuples:
+            self._cls = collections.namedtuple('Return', self._keys, rename=True)
+
+    def __call__(self, value):
+        if not isinstance(value, list) or self._keys is None:
+            return value
+        elif self._cls is not None:
+            return self._cls._make(value)
+        else:
+            return dict(zip(self._keys, value))
@@ -1,56 +1,50 @@
 import asyncio
+import collections
 import contextlib
-import enum
 import os
 import sys
+import time
 
-import msgpack
+try:
+    import fcntl
+except ImportError:  # Not POSIX
+    fcntl = None
 
+from .codec import (  # noqa: F401
+    MsgType, LogLevels, Disconnected, ShapeEncoder, ShapeDecoder,
+    make_packer, make_unpacker,
+)
+from .watchdog import StallWatchdog, watchdog_for
 
-class MsgType(enum.IntEnum):
-    Shoosh = 0  # (Any): ()
 
-    Call = 1  # (C2S): name, params, log
-    Return = 2  # (S2C): value
-    Error = 3  # (S2C): name, additional
-
-    Log = 4  # (S2C): group, level, msg
-
-
-class LogLevels(enum.IntEnum):
-    Trace = 0
-    Debug = 10
-    Verbose = 20
-    Info = 30
-    Warning = 40
-    Error = 50
-    Critical = 60
-
-# TODO: Write functions to go between python and urp log levels.
-
-
-class Disconnected(Exception):
-    """
-    Not currently connected to the server
+class OutboundScheduler:
     """
+    Handles backpressure and shares a write callable between channels.
 
+    While unpaused, writes go straight through. While paused, writes queue up
+    per channel, and on resume the channels are drained round-robin, each
+    getting its weight in packets per turn. A sender is only woken once its
+    own packet is written.
 
-class BackpressureManager:
-    """
-    Handles backpressure and gating access to a callable.
-
-    Raises a BrokenPipeError if called while shutdown.
-
-    NOTE: If a coroutine is passed, it will have to be double-awaited.
+    Raises Disconnected if called while shutdown.
     """
 
     def __init__(self, func):
         self._func = func
-        self._is_blocked = asyncio.Event()
+        self._queues = {}  # channel -> deque of (data, future)
+        self._ring = collections.deque()  # channels with queued writes
+        self._weights = {}
+        self._paused = False
         self._call_exception = None
 
-        # Put us in a known state
-        self.continue_calls()
+    def set_weight(self, channel, weight):
+        """
+        Set how many packets a channel gets to write per turn.
+        """
+        if weight is None or weight == 1:
+            self._weights.pop(channel, None)
+        else:
+            self._weights[channel] = max(1, int(weight))
 
     def pause_calls(self):
         """
@@ -59,7 +53,7 @@ class BackpressureManager:
         Does nothing if closed.
         """
         if self._call_exception is None:
-            self._is_blocked.clear()
+            self._paused = True
 
     def continue_calls(self):
         """
@@ -68,21 +62,70 @@ class BackpressureManager:
         Does nothing if closed.
         """
         if self._call_exception is None:
-            self._is_blocked.set()
+            self._paused = False
+            self._drain()
 
     def shutdown(self, exception=ConnectionError):
         """
         Causes calls to error.
         """
         self._call_exception = exception
-        self._is_blocked.clear()
+        for queue in self._queues.values():
+            for _, fut in queue:
+                if not fut.done():
+                    fut.set_exception(self._disconnected())
+        self._queues.clear()
+        self._ring.clear()
+
+    def _disconnected(self):
+        exc = Disconnected()
+        exc.__cause__ = self._call_exception
+        return exc
+
+    def _drain(self):
+        while self._ring and not self._paused:
+            channel = self._ring[0]
+            queue = self._queues[channel]
+            for _ in range(self._weights.get(channel, 1)):
+                data, fut = queue.popleft()
+                # Skip sends that were cancelled while waiting
+                if not fut.done():
+                    try:
+                        self._func(data)
+                    except Exception as exc:
+                        fut.set_exception(exc)
+                    else:
+                        fut.set_result(None)
+                if not queue or self._paused:
+                    break
+            if queue:
+                self._ring.rotate(-1)
+            else:
+                self._ring.popleft()
+                del self._queues[channel]
 
-    async def __call__(self, *pargs, **kwargs):
-        await self._is_blocked.wait()
-        if self._call_exception is None:
-            return self._func(*pargs, **kwargs)
-        else:
-            raise Disconnected from self._call_exception
+    def try_send(self, channel, data):
+        """
+        Write immediately if nothing is holding writes up. Returns whether it
+        was written.
+        """
+        if self._call_exception is None and not self._paused and not self._ring:
+            self._func(data)
+            return True
+        return False
+
+    async def __call__(self, channel, data):
+        if self._call_exception is not None:
+            raise self._disconnected()
+        elif self.try_send(channel, data):
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        if channel not in self._queues:
+            self._queues[channel] = collections.deque()
+            self._ring.append(channel)
+        self._queues[channel].append((data, fut))
+        await fut
 
 
 # I'm worried that cleaning up channels immediately will cause problems if
@@ -107,10 +150,12 @@ class IdManager_Sequence(dict):
     @contextlib.contextmanager
     def generate(self, reqid=None):
         if reqid is None:
+            # Always move on, so a new call can't be mistaken for a recently
+            # closed one whose Shoosh is still in flight
             reqid = self._next_id
             while reqid in self:
-                reqid = self._next_id
-                self._next_id += 1
+                reqid += 1
+            self._next_id = reqid + 1
 
         self[reqid] = asyncio.Queue()
         try:
@@ -120,30 +165,41 @@ class IdManager_Sequence(dict):
 
 
 class BaseUrpProtocol(asyncio.BaseProtocol):
+    #: A WriteBufferTuner, if the connection is being tuned
+    urp_tuner = None
+    #: The StallWatchdog, if stalls are being watched for
+    urp_watchdog = None
+
     def __init__(self):
-        self._packer = msgpack.Packer(autoreset=True)
-        self._unpacker = msgpack.Unpacker(raw=False)
+        self._packer = make_packer()
+        self._unpacker = make_unpacker()
         self._channels = IdManager_Sequence()
-        self._write_proxy = BackpressureManager(self.urp_write_bytes)
+        self._scheduler = OutboundScheduler(self.urp_write_bytes)
         self._finished = asyncio.Event()
-        self._tasks = []
+        self._tasks = set()
 
     # asyncio callbacks
     def connection_made(self, transport):
         self._transport = transport
-        self._write_proxy.continue_calls()
+        self._scheduler.continue_calls()
 
     def connection_lost(self, exc):
-        self._write_proxy.shutdown(exc)
+        self._scheduler.shutdown(exc)
         for q in self._channels.values():
             q.put_nowait(exc)
+        if self.urp_watchdog is not None:
+            self.urp_watchdog.unwatch(self.urp_stall)
         self._finished.set()
 
     def pause_writing(self):
-        self._write_proxy.pause_calls()
+        if self.urp_tuner is not None:
+            self.urp_tuner.paused()
+        self._scheduler.pause_calls()
 
     def resume_writing(self):
-        self._write_proxy.continue_calls()
+        if self.urp_tuner is not None:
+            self.urp_tuner.resumed()
+        self._scheduler.continue_calls()
 
     # Our additions
     def urp_recv_bytes(self, data):
@@ -153,7 +209,7 @@ class BaseUrpProtocol(asyncio.BaseProtocol):
         self._unpacker.feed(data)
         for msg in self._unpacker:
             if isinstance(msg, str):
-                asyncio.create_task(self.urp_text_recv(msg))
+                self._urp_task(self.urp_text_recv(msg))
             else:
                 self._urp_packet_recv(msg)
 
@@ -163,10 +219,28 @@ class BaseUrpProtocol(asyncio.BaseProtocol):
         """
         cid, *args = msg
         if cid not in self._channels:
-            asyncio.create_task(self.urp_new_channel(cid, args))
+            self._urp_task(self.urp_new_channel(cid, args))
         else:
             self._channels[cid].put_nowait(args)
 
+    def _urp_task(self, coro):
+        """
+        Start a task, tracking it until it's done.
+        """
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def urp_stats(self):
+        """
+        Counts of the resources this connection is holding, for monitoring.
+        """
+        return {
+            'channels': len(self._channels),
+            'tasks': len(self._tasks),
+        }
+
     async def _urp_send_packet(self, packet):
         """
         Send a message. May block due to backpressure.
@@ -174,19 +248,55 @@ class BaseUrpProtocol(asyncio.BaseProtocol):
         Raises BrokenPipeError if unable to send due to closed connection.
         """
         data = self._packer.pack(packet)
-        await self._write_proxy(data)
+        channel = packet[0] if isinstance(packet, list) else None
+        await self._scheduler(channel, data)
 
     @contextlib.contextmanager
-    def urp_open_channel(self, channel_id=None):
+    def urp_open_channel(self, channel_id=None, priority=None):
         """
         Opens a channel defined by request ID.
         Returns a callable (accepting a type and payload to send) and a Queue (where responses go)
+
+        priority is the channel's weight when writes are queued by backpressure.
         """
         with self._channels.generate(channel_id) as (chanid, q):
             async def send(type, *args):
                 await self._urp_send_packet([chanid, type, *args])
 
-            yield send, q
+            self.urp_set_priority(chanid, priority)
+            try:
+                yield send, q
+            finally:
+                self.urp_set_priority(chanid, None)
+
+    def urp_watch_stalls(self, threshold=0.1):
+        """
+        Start watching for the event loop being blocked for longer than
+        threshold seconds, calling urp_stall() for each time it is. Stalls
+        are logged to urp.watchdog too.
+
+        All the connections on a loop share a watchdog; the threshold of the
+        first one applies.
+        """
+        if self.urp_watchdog is None:
+            self.urp_stalls = collections.deque(maxlen=StallWatchdog.history)
+            self.urp_watchdog = watchdog_for(threshold=threshold)
+            self.urp_watchdog.watch(self.urp_stall)
+        return self.urp_watchdog
+
+    def urp_stall(self, stall):
+        """
+        Called with each Stall once the loop is going again. Keeps it in
+        urp_stalls by default.
+        """
+        self.urp_stalls.append(stall)
+
+    def urp_set_priority(self, channel_id, priority):
+        """
+        Sets the weight of a channel's writes when they're queued by
+        backpressure. Higher gets a bigger share; None resets to the default.
+        """
+        self._scheduler.set_weight(channel_id, priority)
 
     async def urp_send_text(self, txt):
         """
@@ -223,8 +333,9 @@ class BaseUrpProtocol(asyncio.BaseProtocol):
         """
         Block until the transport has closed and all tasks have spun down.
         """
-        # TODO: Track tasks
         await self._finished.wait()
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
 
     async def close(self):
         self._transport.close()
@@ -257,7 +368,7 @@ class UrpSubprocessMixin(asyncio.SubprocessProtocol):
 
     def pipe_connection_lost(self, fd, exc):
         if fd == 0:  # SSH's stdin
-            self._write_proxy.shutdown(exc)
+            self._scheduler.shutdown(exc)
 
     def pipe_data_received(self, fd, data):
         if fd == 1:  # stdout
@@ -348,6 +459,9 @@ class StdioTransport(asyncio.Transport):
     def set_write_buffer_limits(self, high=None, low=None):
         return self.writer.set_write_buffer_limits(high, low)
 
+    def get_write_buffer_limits(self):
+        return self.writer.get_write_buffer_limits()
+
     def get_write_buffer_size(self):
         return self.writer.get_write_buffer_size()
 
@@ -382,10 +496,84 @@ def make_stdio_binary():
     return fdin, fdout
 
 
-async def connect_fd(protocol, readfd, writefd):
+# Linux-only, and only named in the fcntl module since Python 3.10
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031 if sys.platform.startswith('linux') else None)
+
+PIPE_SIZE = 1024 * 1024
+
+
+class WriteBufferTuner:
+    """
+    Adjusts a transport's write buffer limits to hold about target_latency
+    seconds of output.
+
+    The drain rate is measured by how long the buffer takes to go from its
+    high water mark to its low water mark. The limits at most double or halve
+    each time.
+    """
+
+    def __init__(self, transport, target_latency=0.05,
+                 minimum=64 * 1024, maximum=16 * 1024 * 1024):
+        self._transport = transport
+        self.target_latency = target_latency
+        self.minimum = minimum
+        self.maximum = maximum
+        self._paused_at = None
+
+    def paused(self):
+        self._paused_at = time.monotonic()
+
+    def resumed(self):
+        if self._paused_at is None:
+            return
+        elapsed = max(time.monotonic() - self._paused_at, 1e-6)
+        self._paused_at = None
+
+        low, high = self._transport.get_write_buffer_limits()
+        rate = (high - low) / elapsed
+        target = int(rate * self.target_latency)
+        target = min(max(target, high // 2, self.minimum), high * 2, self.maximum)
+        if target != high:
+            self._transport.set_write_buffer_limits(high=target, low=target // 4)
+
+
+def tune_pipes(proto, reader, writer, pipe_size=PIPE_SIZE, read_size=PIPE_SIZE,
+               write_buffer='auto'):
+    """
+    Tunes pipe transports for throughput.
+
+    * pipe_size: The kernel pipe buffer size to ask for (Linux only)
+    * read_size: The most to read at once
+    * write_buffer: 'auto' to tune the write buffer limits as we go, a tuple
+      of (high, low), or None to leave them be
+
+    Any of these may be None to leave the defaults.
+    """
+    if pipe_size is not None and F_SETPIPE_SZ is not None:
+        for trans in (reader, writer):
+            pipe = trans.get_extra_info('pipe')
+            try:
+                fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, pipe_size)
+            except (OSError, AttributeError, ValueError):
+                # Not a pipe, or over /proc/sys/fs/pipe-max-size
+                pass
+
+    if read_size is not None and hasattr(reader, 'max_size'):
+        # Implementation detail of asyncio's unix pipe transport
+        reader.max_size = read_size
+
+    if write_buffer == 'auto':
+        proto.urp_tuner = WriteBufferTuner(writer)
+    elif write_buffer is not None:
+        writer.set_write_buffer_limits(*write_buffer)
+
+
+async def connect_fd(protocol, readfd, writefd, **tuning):
     """
     Connects the given protocol (by factory) to the given reader and writer (by
     file descriptor).
+
+    tuning is passed to tune_pipes().
     """
     if isinstance(readfd, int):
         readfd = os.fdopen(readfd, 'rb')
@@ -398,12 +586,13 @@ async def connect_fd(protocol, readfd, writefd):
     trans = StdioTransport()
     trans.set_protocol(proto)
 
-    await asyncio.gather(
+    (reader, _), (writer, _) = await asyncio.gather(
         loop.connect_read_pipe(lambda: trans, readfd),
         loop.connect_write_pipe(lambda: trans, writefd),
     )
+    tune_pipes(proto, reader, writer, **tuning)
     return trans, proto
 
-async def connect_stdio(protocol):
+async def connect_stdio(protocol, **tuning):
     fdin, fdout = make_stdio_binary()
-    return await connect_fd(protocol, fdin, fdout)
+    return await connect_fd(protocol, fdin, fdout, **tuning)
@@ -3,20 +3,36 @@ Framework for defining servers.
 """
 import asyncio
 import collections.abc
+import os
 import socket
+import threading
+import weakref
 
 from .common import connect_fd, connect_stdio
+from .pubsub import Topic
 from .server import ServerStreamProtocol, ServerSubprocessProtocol
+from .sharding import SharedCache, serve_sharded, tcp_listener
+from .validation import compile_validator
+from . import zygote
 
 __all__ = ('method', 'Service')
 
 
-def method(name_or_func=None):
+def method(name_or_func=None, *, shape=None, priority=None):
     """
     @method
     @method("Name")
+    @method(shape=("x", "y", "z"))
 
     Define an URP method. Must be used on an interface class.
+
+    If shape is given, returns are sent as compact positional arrays to clients
+    that support it. It may be a sequence of keys, or True to infer the keys
+    from the returns themselves. Best for streams of identically-keyed maps.
+
+    priority is the method's weight when the connection is congested: a method
+    with priority 4 gets four packets written for every one of a method with
+    the default of 1. Clients may override it per call.
     """
     name = None
 
@@ -25,6 +41,8 @@ def method(name_or_func=None):
         if name is None:
             name = func.__name__
         func.__urp_name__ = name
+        func.__urp_shape__ = shape
+        func.__urp_priority__ = priority
         return func
 
     if isinstance(name_or_func, str) or name_or_func is None:
@@ -46,15 +64,37 @@ class Service(collections.abc.Mapping):
         self.name = name
         self._interfaces = {}
         self._method_index = None
+        self._topics = {}
+        self._connections = weakref.WeakSet()
+        self._lock = threading.Lock()
+        #: State shared between methods, safe to use from sharded loops
+        self.shared = SharedCache()
+        #: If set, connections watch for the event loop being blocked for
+        #: longer than this many seconds (see urp.watchdog)
+        self.stall_threshold = None
+
+    def _get_index(self):
+        """
+        Gets the method index, building it if needed.
 
-    def _update_index(self):
-        self._method_index = {}
-        for iname, icls in self._interfaces.items():
-            for mname in dir(icls):
-                meth = getattr(icls, mname)
-                if hasattr(meth, '__urp_name__'):
-                    fullname = f"{iname}.{meth.__urp_name__}"
-                    self._method_index[fullname] = icls, meth
+        It's built whole before it's published, so other threads (see
+        urp.sharding) never see it half-done.
+        """
+        index = self._method_index
+        if index is not None:
+            return index
+
+        with self._lock:
+            if self._method_index is None:
+                index = {}
+                for iname, icls in self._interfaces.items():
+                    for mname in dir(icls):
+                        meth = getattr(icls, mname)
+                        if hasattr(meth, '__urp_name__'):
+                            fullname = f"{iname}.{meth.__urp_name__}"
+                            index[fullname] = icls, meth, compile_validator(meth)
+                self._method_index = index
+            return self._method_index
 
     def interface(self, name):
         """
@@ -63,39 +103,90 @@ class Service(collections.abc.Mapping):
         Adds an interface to the service
         """
         def _(icls):
-            self._interfaces[name] = icls
-            self._method_index = None
+            with self._lock:
+                self._interfaces[name] = icls
+                self._method_index = None
             return icls
         return _
 
-    def __getitem__(self, key):
-        if self._method_index is None:
-            self._update_index()
+    def _track_connection(self, proto):
+        with self._lock:
+            self._connections.add(proto)
+
+    def _untrack_connection(self, proto):
+        with self._lock:
+            self._connections.discard(proto)
+
+    def topic(self, name):
+        """
+        Gets (creating if needed) the named Topic.
 
-        cls, meth = self._method_index[key]
+        Methods return topic.subscribe() to stream its events to the caller,
+        and the application calls topic.publish() to send to all subscribers.
+        """
+        with self._lock:
+            try:
+                return self._topics[name]
+            except KeyError:
+                topic = self._topics[name] = Topic(name)
+                return topic
+
+    def stats(self):
+        """
+        Counts of open connections, channels, and tasks, for monitoring.
+
+        Expose it from a method for the load generator to poll.
+        """
+        stats = {'connections': 0, 'channels': 0, 'tasks': 0}
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            stats['connections'] += 1
+            for k, v in conn.urp_stats().items():
+                stats[k] += v
+        return stats
+
+    def __getitem__(self, key):
+        cls, meth, _ = self._get_index()[key]
         bound_meth = meth.__get__(cls())  # Very Py3 way
-        # Wrap to handle things like:
-        # * Producing an .InvalidParameters if applicable
         return bound_meth
 
-    def __iter__(self):
-        if self._method_index is None:
-            self._update_index()
+    def _check_call(self, key, kwargs, supplied=()):
+        """
+        Checks a call before it's dispatched. Gives None if it's ok, or the
+        name and additional data of the error to reply with.
 
-        yield from self._method_index
+        supplied are the names of parameters the server fills in itself.
+        """
+        try:
+            _, _, validate = self._get_index()[key]
+        except (KeyError, TypeError):
+            return '.NotAMethod', None
+        problem = validate(kwargs, supplied)
+        if problem is not None:
+            return '.InvalidParameters', problem
+        return None
 
-    def __len__(self):
-        if self._method_index is None:
-            self._update_index()
+    def __iter__(self):
+        yield from self._get_index()
 
-        return len(self._method_index)
+    def __len__(self):
+        return len(self._get_index())
 
-    async def listen_tcp(self, bind_host, bind_port, **opts):
+    async def listen_tcp(self, bind_host, bind_port, *, loops=1, **opts):
         """
         Listen on TCP.
 
-        Additional options are passed to create_server()
+        If loops is more than 1, connections are spread over that many event
+        loops in their own threads (see urp.sharding), and additional options
+        are passed to connect_accepted_socket(). Otherwise, they're passed to
+        create_server().
         """
+        if loops > 1:
+            sock = tcp_listener(bind_host, bind_port)
+            await serve_sharded(sock, lambda: ServerStreamProtocol(self), loops, **opts)
+            return
+
         loop = asyncio.get_running_loop()
 
         server = await loop.create_server(
@@ -105,12 +196,22 @@ class Service(collections.abc.Mapping):
         async with server:
             await server.serve_forever()
 
-    async def listen_unix(self, socketpath, **opts):
+    async def listen_unix(self, socketpath, *, loops=1, **opts):
         """
         Listen on a Unix Domain Socket.
 
-        Additional options are passed to create_server()
+        If loops is more than 1, connections are spread over that many event
+        loops in their own threads (see urp.sharding), and additional options
+        are passed to connect_accepted_socket(). Otherwise, they're passed to
+        create_server().
         """
+        if loops > 1:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(socketpath)
+            sock.listen()
+            await serve_sharded(sock, lambda: ServerStreamProtocol(self), loops, **opts)
+            return
+
         loop = asyncio.get_running_loop()
 
         server = await loop.create_unix_server(
@@ -161,25 +262,49 @@ class Service(collections.abc.Mapping):
 
         await proto.finished()
 
-    async def serve_inherited_fd(self, fd_reader, fd_writer):
+    async def serve_inherited_fd(self, reader_fd, writer_fd, **tuning):
         """
         Serve a client connected by inherited file descriptor.
 
         Note that both file descriptors may be the same
+
+        tuning is passed to tune_pipes().
         """
         transpo, proto = await connect_fd(
             lambda: ServerStreamProtocol(self),
-            reader_fd, writer_fd
+            reader_fd, writer_fd, **tuning
         )
 
         await proto.finished()
 
-    async def serve_stdio(self):
+    async def serve_stdio(self, **tuning):
         """
         Serve a client connected by stdin/stdout
+
+        tuning is passed to tune_pipes(): pipe_size, read_size, and
+        write_buffer.
         """
         transpo, proto = await connect_stdio(
             lambda: ServerStreamProtocol(self),
+            **tuning
         )
 
         await proto.finished()
+
+    def run_stdio(self, **tuning):
+        """
+        Serve a client connected by stdin/stdout, blocking until done.
+
+        If started by spawn_zygote(), act as a zygote instead, forking a
+        server for each client.
+
+        tuning is passed to serve_stdio().
+        """
+        control_fd = os.environ.pop(zygote.ENV_VAR, None)
+        if control_fd is None:
+            asyncio.run(self.serve_stdio(**tuning))
+        else:
+            zygote.run_zygote(
+                int(control_fd),
+                lambda fd: asyncio.run(self.serve_inherited_socket(fd)),
+            )
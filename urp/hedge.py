@@ -0,0 +1,164 @@
+"""
+Hedged calls across replicas of a service.
+
+A hedged call goes to one replica, and if it hasn't answered within the
+usual (percentile) latency for that method, the same call goes to a second
+replica too. Whichever answers first is used and the other is Shooshed.
+
+Only hedge methods that are safe to run twice, like reads.
+"""
+import asyncio
+import collections
+import itertools
+import time
+
+from .common import Disconnected
+
+__all__ = ('HedgedClient',)
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(q * len(values))) - 1))
+    return values[index]
+
+
+async def _next(gen):
+    """
+    Gets the next item of an async generator, as (done, value).
+    """
+    try:
+        return False, await gen.__anext__()
+    except StopAsyncIteration:
+        return True, None
+
+
+class HedgedClient:
+    """
+    A client over several connections to replicas of the same service.
+
+    Calls are spread round-robin. Calls to the methods named in hedged are
+    sent to a second replica if the first hasn't answered within the
+    quantile of that method's recent latencies (or initial_delay, until
+    there's enough history). No more than budget (a fraction) of calls are
+    hedged, so a slow service doesn't double its load.
+
+    Use like a client: client['name'](**args)
+    """
+
+    #: How many latencies to keep per method
+    window = 1000
+    #: How many latencies are needed before using the percentile
+    min_samples = 20
+
+    def __init__(self, clients, hedged=(), *, quantile=0.95, initial_delay=0.05,
+                 budget=0.1):
+        if not clients:
+            raise ValueError("Need at least one client")
+        self.clients = list(clients)
+        self.hedged = set(hedged)
+        self.quantile = quantile
+        self.initial_delay = initial_delay
+        self.budget = budget
+        self._rotation = itertools.cycle(range(len(self.clients)))
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.window))
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def delay(self, key):
+        """
+        How long to wait for an answer before hedging a call.
+        """
+        samples = self._latencies[key]
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        return percentile(sorted(samples), self.quantile)
+
+    def _can_hedge(self):
+        return len(self.clients) > 1 and self.hedges < self.budget * self.calls
+
+    def __getitem__(self, key):
+        """
+        Gets a method.
+
+        Methods take keyword arguments and produce a sequence of returns and errors
+        """
+        return self.urp_method(key)
+
+    def urp_method(self, key, *, hedge=None):
+        """
+        Gets a method, with options.
+
+        hedge overrides whether the method is in hedged.
+        """
+        if hedge is None:
+            hedge = key in self.hedged
+
+        async def call_method(**args):
+            self.calls += 1
+            first = next(self._rotation)
+            gens = [self.clients[first][key](**args)]
+            start = time.monotonic()
+            tasks = {asyncio.create_task(_next(gens[0])): gens[0]}
+            winner = None
+            try:
+                timeout = self.delay(key) if hedge else None
+                while winner is None:
+                    done, _ = await asyncio.wait(
+                        tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    timeout = None
+                    if not done:
+                        if self._can_hedge():
+                            self.hedges += 1
+                            second = (first + 1) % len(self.clients)
+                            gens.append(self.clients[second][key](**args))
+                            tasks[asyncio.create_task(_next(gens[1]))] = gens[1]
+                        continue
+                    for task in done:
+                        gen = tasks.pop(task)
+                        if isinstance(task.exception(), Disconnected) and tasks:
+                            # Let the other replica answer
+                            continue
+                        winner = gen
+                        answer = task.result()
+                        break
+            finally:
+                # Shoosh the loser
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                for gen in gens:
+                    if gen is not winner:
+                        await gen.aclose()
+
+            self._latencies[key].append(time.monotonic() - start)
+            if winner is not gens[0]:
+                self.hedge_wins += 1
+
+            try:
+                done, val = answer
+                if done:
+                    return
+                yield val
+                async for val in winner:
+                    yield val
+            finally:
+                await winner.aclose()
+
+        return call_method
+
+    async def close(self):
+        for client in self.clients:
+            await client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
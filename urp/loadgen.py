@@ -0,0 +1,240 @@
+"""
+Load and soak testing.
+
+Drives a server with a mix of calls at a target rate, periodically reporting
+throughput, latency, and resource counts (to catch leaks).
+
+    python -m urp.loadgen --spawn "python server.py" \\
+        --mix unary:example.Echo:70 --mix stream:example.gen:20 \\
+        --mix cancel:example.async_gen:5 --mix error:example.error:5 \\
+        --params 'example.error={"msg": "boom"}' \\
+        --rate 500 --duration 3600
+"""
+import argparse
+import asyncio
+import json
+import random
+import shlex
+import sys
+import time
+
+from .client import connect_tcp, connect_unix, spawn_server
+from .hedge import percentile
+from .pool import _rss
+
+__all__ = ('LoadGenerator',)
+
+KINDS = ('unary', 'stream', 'cancel', 'error')
+
+
+class LoadGenerator:
+    """
+    Makes calls against a client at a target rate.
+
+    mix is a sequence of (kind, method, params, weight), where kind is:
+    * unary, stream: Consume all the returns
+    * cancel: Cancel the call after the first return
+    * error: Consume all the returns, expecting an error
+
+    stats, if given, is a method name polled each interval for server-side
+    counts (eg one that returns Service.stats()). pid, if given, is the server
+    process to watch the memory of.
+    """
+
+    def __init__(self, client, mix, rate, *, concurrency=1000, stats=None, pid=None):
+        self.client = client
+        self.mix = mix
+        self.rate = rate
+        self.concurrency = concurrency
+        self.stats = stats
+        self.pid = pid
+        self.samples = []
+        self._reset()
+
+    def _reset(self):
+        self._latencies = []
+        self._failures = 0
+        self._unexpected = 0
+        self._skipped = 0
+
+    async def _call(self, kind, name, params):
+        start = time.perf_counter()
+        errored = False
+        gen = self.client[name](**params)
+        try:
+            async for result in gen:
+                if isinstance(result, Exception):
+                    errored = True
+                if kind == 'cancel':
+                    break
+        except Exception:
+            self._failures += 1
+            return
+        finally:
+            await gen.aclose()
+        self._latencies.append(time.perf_counter() - start)
+        if errored != (kind == 'error'):
+            self._unexpected += 1
+
+    async def _sample(self, elapsed, interval):
+        latencies = sorted(self._latencies)
+        sample = {
+            'time': elapsed,
+            'rate': len(latencies) / interval,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'p999': percentile(latencies, 0.999),
+            'failures': self._failures,
+            'unexpected': self._unexpected,
+            'skipped': self._skipped,
+            'client': self.client.urp_stats(),
+            'local_tasks': len(asyncio.all_tasks()),
+        }
+        if self.stats is not None:
+            async for result in self.client[self.stats]():
+                sample['server'] = result
+        if self.pid is not None:
+            sample['rss'] = _rss(self.pid)
+        self._reset()
+        self.samples.append(sample)
+        return sample
+
+    async def run(self, duration, interval=1.0, report=None):
+        """
+        Generate load for duration seconds, sampling every interval seconds.
+
+        report is called with each sample. Returns the samples.
+        """
+        kinds = [(kind, name, params) for kind, name, params, _ in self.mix]
+        weights = [weight for *_, weight in self.mix]
+        inflight = set()
+
+        loop = asyncio.get_running_loop()
+        start = next_call = next_sample = loop.time()
+        end = start + duration
+        next_sample += interval
+        while loop.time() < end:
+            now = loop.time()
+            # Open loop: keep to the schedule regardless of how calls are doing
+            while next_call <= now:
+                next_call += 1 / self.rate
+                if len(inflight) >= self.concurrency:
+                    self._skipped += 1
+                    continue
+                kind, name, params = random.choices(kinds, weights)[0]
+                task = asyncio.create_task(self._call(kind, name, params))
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+            if now >= next_sample:
+                sample = await self._sample(now - start, interval)
+                next_sample += interval
+                if report is not None:
+                    report(sample)
+            await asyncio.sleep(max(0, min(next_call, next_sample) - loop.time()))
+
+        if inflight:
+            await asyncio.wait(inflight)
+        sample = await self._sample(loop.time() - start, interval)
+        if report is not None:
+            report(sample)
+        return self.samples
+
+
+def _format(sample):
+    def ms(v):
+        return '-' if v is None else f"{v * 1000:.2f}"
+
+    parts = [
+        f"t={sample['time']:.0f}s",
+        f"rate={sample['rate']:.0f}/s",
+        f"p50={ms(sample['p50'])}ms",
+        f"p99={ms(sample['p99'])}ms",
+        f"p999={ms(sample['p999'])}ms",
+        f"fail={sample['failures']}",
+        f"unexpected={sample['unexpected']}",
+        f"skipped={sample['skipped']}",
+        "client={channels}ch/{tasks}t".format(**sample['client']),
+        f"local_tasks={sample['local_tasks']}",
+    ]
+    if 'server' in sample:
+        parts.append(' '.join(f"server_{k}={v}" for k, v in sample['server'].items()))
+    if sample.get('rss') is not None:
+        parts.append(f"rss={sample['rss'] // 1024}KiB")
+    return ' '.join(parts)
+
+
+def _parse_mix(text):
+    kind, name, *weight = text.split(':')
+    if kind not in KINDS:
+        raise argparse.ArgumentTypeError(f"kind must be one of {', '.join(KINDS)}")
+    return kind, name, float(weight[0]) if weight else 1.0
+
+
+def _parse_params(text):
+    name, _, params = text.partition('=')
+    return name, json.loads(params)
+
+
+async def main(args):
+    pid = args.pid
+    if args.tcp:
+        host, _, port = args.tcp.rpartition(':')
+        client = await connect_tcp(host, int(port))
+    elif args.unix:
+        client = await connect_unix(args.unix)
+    else:
+        client = await spawn_server(*shlex.split(args.spawn))
+        pid = client._transport.get_pid()
+
+    params = dict(args.params)
+    mix = [(kind, name, params.get(name, {}), weight) for kind, name, weight in args.mix]
+
+    async with client:
+        gen = LoadGenerator(
+            client, mix, args.rate,
+            concurrency=args.concurrency, stats=args.stats, pid=pid,
+        )
+        samples = await gen.run(
+            args.duration, args.interval,
+            report=lambda s: print(_format(s), flush=True),
+        )
+
+    rss = [s['rss'] for s in samples if s.get('rss') is not None]
+    if len(rss) >= 2:
+        print(f"RSS growth: {(rss[-1] - rss[0]) // 1024}KiB")
+    leftover = samples[-1]['client']
+    if any(leftover.values()):
+        print(f"Client still holding resources: {leftover}")
+        return 1
+    return 0
+
+
+def _argparser():
+    parser = argparse.ArgumentParser(
+        prog='python -m urp.loadgen',
+        description="Drive a URP server with load, watching for leaks.",
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--tcp', metavar='HOST:PORT')
+    target.add_argument('--unix', metavar='PATH')
+    target.add_argument('--spawn', metavar='COMMAND', help="Server to run on stdio")
+    parser.add_argument(
+        '--mix', metavar='KIND:METHOD[:WEIGHT]', type=_parse_mix,
+        action='append', required=True,
+        help=f"Kind is one of {', '.join(KINDS)}. May be repeated.",
+    )
+    parser.add_argument(
+        '--params', metavar='METHOD=JSON', type=_parse_params,
+        action='append', default=[],
+    )
+    parser.add_argument('--rate', type=float, default=100, help="Calls per second")
+    parser.add_argument('--concurrency', type=int, default=1000, help="Most calls in flight")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds")
+    parser.add_argument('--interval', type=float, default=1, help="Seconds between reports")
+    parser.add_argument('--stats', metavar='METHOD', help="Method giving server-side counts")
+    parser.add_argument('--pid', type=int, help="Server process to watch the memory of")
+    return parser
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(_argparser().parse_args())))
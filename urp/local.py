@@ -0,0 +1,137 @@
+"""
+In-process connections.
+
+A LocalClient talks to a Service in the same process, handing packets
+straight to the server side instead of serializing them. Channels, Shoosh,
+and errors behave the same as over a real connection.
+"""
+import copy
+
+from .client import ClientBaseProtocol
+from .codec import Disconnected, MsgType, packb, unpackb
+from .server import ServerBaseProtocol
+
+__all__ = ('LocalClient', 'connect_local')
+
+COPY_MODES = (None, 'deep', 'msgpack')
+
+
+class _LocalMixin:
+    """
+    Hands packets to a peer protocol rather than a transport.
+    """
+    _peer = None
+    _copy = None
+
+    async def _urp_send_packet(self, packet):
+        if self._finished.is_set():
+            raise Disconnected
+        if self._copy == 'deep':
+            packet = copy.deepcopy(packet)
+        elif self._copy == 'msgpack':
+            # Also checks that it would've survived the wire
+            packet = unpackb(packb(packet))
+        self._peer._urp_local_recv(packet)
+
+    def _urp_local_recv(self, packet):
+        if isinstance(packet, str):
+            self._urp_task(self.urp_text_recv(packet))
+        else:
+            self._urp_packet_recv(packet)
+
+    def urp_write_bytes(self, data):
+        # For anything that writes pre-serialized packets (eg topics)
+        self.urp_recv_bytes(data)
+
+    def urp_recv_bytes(self, data):
+        self._unpacker.feed(data)
+        for msg in self._unpacker:
+            self._peer._urp_local_recv(msg)
+
+
+class _LocalServerProtocol(_LocalMixin, ServerBaseProtocol):
+    """
+    Runs each call as a single task, cancelled directly by Shoosh, instead of
+    supervising it from the channel queue.
+    """
+
+    def __init__(self, router):
+        super().__init__(router)
+        self._running = {}
+
+    def connection_lost(self, exc):
+        for task in self._running.values():
+            task.cancel()
+        super().connection_lost(exc)
+
+    def _urp_packet_recv(self, msg):
+        cid, *args = msg
+        if args[0] == MsgType.Call and cid not in self._running:
+            if not self._urp_reject(msg):
+                self._running[cid] = self._urp_task(self._local_call(cid, args))
+        elif args[0] == MsgType.Shoosh and cid in self._running:
+            self._running.pop(cid).cancel()
+        else:
+            super()._urp_packet_recv(msg)
+
+    async def _local_call(self, channel_id, msg):
+        options = msg[4] if len(msg) > 4 and isinstance(msg[4], dict) else {}
+        with self.urp_open_channel(channel_id) as (send, queue):
+            try:
+                await self._method_task(
+                    channel_id, send, msg[1] if len(msg) > 1 else None,
+                    msg[2] if len(msg) > 2 else None, options)
+                await send(MsgType.Shoosh)
+            finally:
+                self._running.pop(channel_id, None)
+
+
+class LocalClient(_LocalMixin, ClientBaseProtocol):
+    """
+    A client connected directly to a Service in this process.
+
+    By default values are passed by reference. copy may be 'deep' to deep-copy
+    every packet, or 'msgpack' to round-trip them through msgpack (catching
+    anything that couldn't be sent over a real connection).
+    """
+
+    def __init__(self, service, copy=None):
+        if copy not in COPY_MODES:
+            raise ValueError(f"Unknown copy mode {copy!r}")
+        super().__init__()
+        self._copy = copy
+        self._peer = _LocalServerProtocol(service)
+        self._peer._copy = copy
+        self._peer._peer = self
+        self._peer.connection_made(None)
+        self.connection_made(None)
+
+    def __getitem__(self, key):
+        """
+        Gets a method.
+
+        Methods take keyword arguments and produce a sequence of returns and errors
+        """
+        # Shapes only save bytes, and there are no bytes
+        return self.urp_method(key, shapes=False)
+
+    async def close(self):
+        if not self._finished.is_set():
+            self._peer.connection_lost(None)
+            self.connection_lost(None)
+
+    async def finished(self):
+        """
+        Block until closed and all tasks (on both sides) have spun down.
+        """
+        await super().finished()
+        await self._peer.finished()
+
+
+def connect_local(service, copy=None):
+    """
+    Connect to the given Service in this process, without serialization.
+
+    See LocalClient for copy.
+    """
+    return LocalClient(service, copy)
@@ -0,0 +1,233 @@
+"""
+Pools of server subprocesses.
+"""
+import asyncio
+import operator
+import os
+
+from .client import spawn_server
+
+__all__ = ('SubprocessPool', 'spawn_pool')
+
+
+def _rss(pid):
+    """
+    Gets the resident memory of the given process, in bytes, or None if we
+    can't tell.
+    """
+    try:
+        with open(f"/proc/{pid}/statm", 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Worker:
+    __slots__ = ('proto', 'inflight', 'calls', 'retired')
+
+    def __init__(self, proto):
+        self.proto = proto
+        self.inflight = 0
+        self.calls = 0
+        self.retired = False
+
+    @property
+    def alive(self):
+        return not self.proto._finished.is_set()
+
+    @property
+    def pid(self):
+        return self.proto._transport.get_pid()
+
+
+class SubprocessPool:
+    """
+    A number of server subprocesses running the same command, with calls
+    distributed to whichever is least busy.
+
+    Crashed workers are respawned, backing off exponentially from
+    respawn_delay while they keep crashing. After max_crashes crashes in a
+    row with no call getting through, the pool gives up: once no workers are
+    left, calls fail. Workers are recycled after max_calls calls or once they
+    use more than max_memory bytes (where supported).
+
+    Use like a client: pool['name'](**args)
+    """
+
+    #: Seconds to wait before the first respawn after a crash
+    respawn_delay = 0.1
+    #: The longest to wait between respawns
+    max_respawn_delay = 30
+    #: How many crashes in a row before giving up
+    max_crashes = 5
+
+    def __init__(self, cmd, size=None, *, max_calls=None, max_memory=None, tuning=None):
+        self._cmd = cmd
+        self._tuning = tuning or {}
+        self.size = size if size is not None else (os.cpu_count() or 1)
+        self.max_calls = max_calls
+        self.max_memory = max_memory
+        self._workers = []
+        self._available = asyncio.Event()
+        self._tasks = set()
+        self._closed = False
+        self._crashes = 0
+        self._failed = None
+
+    async def start(self):
+        """
+        Spawn the initial workers.
+        """
+        await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+
+    def _task(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _spawn(self):
+        proto = await spawn_server(*self._cmd, **self._tuning)
+        worker = _Worker(proto)
+        if self._closed:
+            await proto.close()
+            return
+        self._workers.append(worker)
+        self._available.set()
+        self._task(self._watch(worker))
+
+    async def _watch(self, worker):
+        await worker.proto.finished()
+        if not worker.retired:
+            # Crashed
+            self._remove(worker)
+            await self._respawn(crashed=True)
+
+    async def _respawn(self, crashed=False):
+        """
+        Spawn a replacement worker, backing off if they keep crashing.
+        """
+        error = None
+        while not self._closed and self._failed is None:
+            if crashed:
+                self._crashes += 1
+                if self._crashes > self.max_crashes:
+                    self._give_up(error)
+                    return
+                await asyncio.sleep(min(
+                    self.max_respawn_delay,
+                    self.respawn_delay * 2 ** (self._crashes - 1),
+                ))
+            try:
+                await self._spawn()
+                return
+            except Exception as exc:
+                error = exc
+                crashed = True
+
+    def _give_up(self, cause):
+        self._failed = RuntimeError("Pool workers keep crashing")
+        self._failed.__cause__ = cause
+        # Wake anybody waiting for a worker
+        self._available.set()
+
+    def _remove(self, worker):
+        if worker in self._workers:
+            self._workers.remove(worker)
+        if not self._workers:
+            self._available.clear()
+
+    def _retire(self, worker):
+        """
+        Take a worker out of rotation, replace it, and close it once it's idle.
+        """
+        worker.retired = True
+        self._remove(worker)
+        if not self._closed:
+            self._task(self._respawn())
+        if worker.inflight == 0:
+            self._task(worker.proto.close())
+
+    async def _pick(self):
+        # Don't wait for _watch() to notice
+        for worker in [w for w in self._workers if not w.alive]:
+            self._remove(worker)
+
+        while not self._workers:
+            if self._closed:
+                raise RuntimeError("Pool is closed")
+            elif self._failed is not None:
+                raise self._failed
+            await self._available.wait()
+
+        worker = min(self._workers, key=operator.attrgetter('inflight'))
+        worker.inflight += 1
+        worker.calls += 1
+        if self.max_calls is not None and worker.calls >= self.max_calls:
+            self._retire(worker)
+        return worker
+
+    def _release(self, worker):
+        worker.inflight -= 1
+        if worker.alive:
+            # Things are working, so forget earlier crashes
+            self._crashes = 0
+        if worker.retired:
+            if worker.inflight == 0:
+                self._task(worker.proto.close())
+        elif self.max_memory is not None:
+            rss = _rss(worker.pid)
+            if rss is not None and rss > self.max_memory:
+                self._retire(worker)
+
+    def __getitem__(self, key):
+        """
+        Gets a method.
+
+        Methods take keyword arguments and produce a sequence of returns and errors
+        """
+        async def call_method(**args):
+            worker = await self._pick()
+            try:
+                async for val in worker.proto[key](**args):
+                    yield val
+            finally:
+                self._release(worker)
+
+        return call_method
+
+    async def close(self):
+        self._closed = True
+        self._available.set()
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.retired = True
+            await worker.proto.close()
+
+    async def finished(self):
+        """
+        Block until all workers have exited.
+        """
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        await self.finished()
+
+
+async def spawn_pool(*cmd, size=None, max_calls=None, max_memory=None, **tuning):
+    """
+    Run a pool of subprocesses on the assumption they will serve on stdio and
+    connect clients to them.
+
+    size defaults to the number of CPUs. tuning is passed to spawn_server().
+    """
+    pool = SubprocessPool(
+        cmd, size, max_calls=max_calls, max_memory=max_memory, tuning=tuning,
+    )
+    await pool.start()
+    return pool
@@ -0,0 +1,436 @@
+"""
+Forwarding proxy, routing calls to backends by method name.
+
+Only the packet headers (channel ID, type, and method name) are decoded. The
+rest of each packet is forwarded as the raw bytes it arrived as.
+
+Flow control is by connection, not by call: when a client can't keep up, the
+proxy stops reading from the backends it has calls on (and likewise for a
+slow backend and its clients). Other clients with calls on those backends
+wait too, so clients that read slowly should get their own backend
+connections.
+"""
+import asyncio
+import socket
+import sys
+
+import msgpack
+
+from .common import MsgType
+
+__all__ = ('Proxy',)
+
+
+class PacketSplitter:
+    """
+    Splits a msgpack stream into the raw bytes of each packet, without
+    decoding them.
+    """
+
+    def __init__(self):
+        self._unpacker = msgpack.Unpacker()
+        self._buf = bytearray()
+        self._start = 0  # Stream offset of _buf[0]
+
+    def feed(self, data):
+        """
+        Feed data, producing the complete packets
+        """
+        self._unpacker.feed(data)
+        self._buf += data
+        last = 0
+        try:
+            while True:
+                self._unpacker.skip()
+                end = self._unpacker.tell() - self._start
+                yield bytes(self._buf[last:end])
+                last = end
+        except msgpack.OutOfData:
+            pass
+        finally:
+            del self._buf[:last]
+            self._start += last
+
+
+def _read_uint(packet, pos):
+    """
+    Reads a non-negative int at pos, returning the value and the end offset.
+    """
+    b = packet[pos]
+    if b < 0x80:
+        return b, pos + 1
+    size = {0xcc: 1, 0xcd: 2, 0xce: 4, 0xcf: 8}.get(b)
+    if size is None:
+        raise ValueError(f"Expected unsigned int, got 0x{b:02x}")
+    end = pos + 1 + size
+    return int.from_bytes(packet[pos + 1:end], 'big'), end
+
+
+def _read_str(packet, pos):
+    """
+    Reads a str at pos, returning the value and the end offset.
+    """
+    b = packet[pos]
+    if 0xa0 <= b <= 0xbf:
+        length, pos = b & 0x1f, pos + 1
+    else:
+        size = {0xd9: 1, 0xda: 2, 0xdb: 4}.get(b)
+        if size is None:
+            raise ValueError(f"Expected str, got 0x{b:02x}")
+        length = int.from_bytes(packet[pos + 1:pos + 1 + size], 'big')
+        pos += 1 + size
+    return packet[pos:pos + length].decode('utf-8'), pos + length
+
+
+def split_header(packet):
+    """
+    Splits a raw array packet into its array header, channel ID, and body (the
+    type and everything after it). Returns None for string packets.
+    """
+    b = packet[0]
+    if 0x90 <= b <= 0x9f:
+        hlen = 1
+    elif b == 0xdc:
+        hlen = 3
+    elif b == 0xdd:
+        hlen = 5
+    else:
+        return None
+    cid, end = _read_uint(packet, hlen)
+    return packet[:hlen], cid, packet[end:]
+
+
+def call_name(body):
+    """
+    Gets the method name from the body of a Call packet.
+    """
+    return _read_str(body, 1)[0]
+
+
+def join_header(prefix, cid, body):
+    return prefix + msgpack.packb(cid) + body
+
+
+class _ProxySide(asyncio.Protocol):
+    """
+    Common bits of the client and backend sides of the proxy.
+    """
+    _transport = None
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self._splitter = PacketSplitter()
+        self._paused_by = set()  # Peers that have us paused reading
+        self._pausing = set()  # Peers we've paused reading
+        self._finished = asyncio.Event()
+
+    def connection_made(self, transport):
+        self._transport = transport
+        if self._paused_by:
+            transport.pause_reading()
+
+    def connection_lost(self, exc):
+        # Don't leave anybody waiting on us
+        self._resume_peers()
+        self._finished.set()
+
+    @property
+    def closed(self):
+        return self._transport is None or self._transport.is_closing()
+
+    def data_received(self, data):
+        try:
+            for packet in self._splitter.feed(data):
+                header = split_header(packet)
+                if header is None:
+                    sys.stderr.write(msgpack.unpackb(packet))
+                else:
+                    self.packet_recv(*header)
+        except (ValueError, IndexError, msgpack.UnpackException):
+            # Protocol error
+            self._transport.close()
+
+    def packet_recv(self, prefix, cid, body):
+        raise NotImplementedError
+
+    def send(self, prefix, cid, body):
+        self._transport.write(join_header(prefix, cid, body))
+
+    def send_packet(self, cid, type, *args):
+        self._transport.write(msgpack.packb([cid, type, *args]))
+
+    # Flow control: when one side can't keep up, stop reading from the other.
+    def peers(self):
+        """
+        The connections on the other side of the proxy that we have calls
+        with.
+        """
+        raise NotImplementedError
+
+    def pause_writing(self):
+        for peer in self.peers():
+            if peer not in self._pausing:
+                self._pausing.add(peer)
+                peer.pause_reading(self)
+
+    def resume_writing(self):
+        self._resume_peers()
+
+    def _resume_peers(self):
+        pausing, self._pausing = self._pausing, set()
+        for peer in pausing:
+            peer.resume_reading(self)
+
+    def pause_reading(self, by):
+        if not self._paused_by and not self.closed:
+            self._transport.pause_reading()
+        self._paused_by.add(by)
+
+    def resume_reading(self, by):
+        if by not in self._paused_by:
+            return
+        self._paused_by.discard(by)
+        if not self._paused_by and not self.closed:
+            self._transport.resume_reading()
+
+    async def finished(self):
+        await self._finished.wait()
+
+
+class ProxyFrontend(_ProxySide):
+    """
+    A connection from a client.
+    """
+
+    def __init__(self, proxy):
+        super().__init__(proxy)
+        self._channels = {}  # client cid -> backend, backend cid
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.proxy._frontends.add(self)
+
+    def connection_lost(self, exc):
+        self.proxy._frontends.discard(self)
+        for backend, bcid in self._channels.values():
+            backend.unbind(bcid)
+            backend.send_packet(bcid, MsgType.Shoosh)
+        self._channels.clear()
+        super().connection_lost(exc)
+
+    def packet_recv(self, prefix, cid, body):
+        if cid in self._channels:
+            backend, bcid = self._channels[cid]
+            if body[0] == MsgType.Shoosh:
+                self.unbind(cid)
+                backend.unbind(bcid)
+            backend.send(prefix, bcid, body)
+        elif body[0] == MsgType.Call:
+            backend = self.proxy.route(call_name(body))
+            if backend is None or backend.closed:
+                self.send_packet(cid, MsgType.Error, '.NotAMethod', None)
+                self.send_packet(cid, MsgType.Shoosh)
+            else:
+                bcid = backend.bind(self, cid)
+                self._channels[cid] = backend, bcid
+                backend.send(prefix, bcid, body)
+        # Else a straggler for a closed channel
+
+    def unbind(self, cid):
+        self._channels.pop(cid, None)
+
+    def peers(self):
+        return {backend for backend, _ in self._channels.values()}
+
+
+class ProxyBackend(_ProxySide):
+    """
+    A connection to a backend server.
+    """
+
+    def __init__(self, proxy):
+        super().__init__(proxy)
+        self._channels = {}  # backend cid -> frontend, client cid
+        self._next_id = 0
+
+    def connection_lost(self, exc):
+        self.proxy.remove_backend(self)
+        for frontend, fcid in self._channels.values():
+            frontend.unbind(fcid)
+            frontend.send_packet(
+                fcid, MsgType.Error, '.Disconnected', {'msg': "Backend disconnected"})
+            frontend.send_packet(fcid, MsgType.Shoosh)
+        self._channels.clear()
+        super().connection_lost(exc)
+
+    def bind(self, frontend, fcid):
+        """
+        Allocate a backend channel for the given client channel.
+        """
+        while self._next_id in self._channels:
+            self._next_id += 1
+        bcid = self._next_id
+        self._next_id += 1
+        self._channels[bcid] = frontend, fcid
+        return bcid
+
+    def unbind(self, bcid):
+        self._channels.pop(bcid, None)
+
+    def packet_recv(self, prefix, cid, body):
+        try:
+            frontend, fcid = self._channels[cid]
+        except KeyError:
+            # Straggler for a closed channel
+            return
+        if body[0] == MsgType.Shoosh:
+            self.unbind(cid)
+            frontend.unbind(fcid)
+        frontend.send(prefix, fcid, body)
+
+    def peers(self):
+        return {frontend for frontend, _ in self._channels.values()}
+
+
+class Proxy:
+    """
+    Forwards calls to backend servers, by the longest matching prefix of the
+    method name.
+
+    Use connect_*() to add backends and listen_*() to accept clients.
+    """
+
+    #: How many method names to remember the routes of
+    route_cache_size = 1024
+
+    def __init__(self):
+        self._routes = {}
+        self._route_cache = {}
+        self._backends = set()
+        self._frontends = set()
+
+    def add_route(self, prefix, backend):
+        """
+        Send calls for methods starting with prefix to the given backend.
+        """
+        self._routes[prefix] = backend
+        self._backends.add(backend)
+        self._route_cache.clear()
+
+    def remove_backend(self, backend):
+        """
+        Stop sending calls to the given backend.
+        """
+        self._routes = {p: b for p, b in self._routes.items() if b is not backend}
+        self._backends.discard(backend)
+        self._route_cache.clear()
+
+    def route(self, name):
+        """
+        Finds the backend for the given method name, or None.
+        """
+        try:
+            return self._route_cache[name]
+        except KeyError:
+            pass
+        best = None
+        for prefix, backend in self._routes.items():
+            if name.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        if best is None:
+            # Don't let junk names fill the cache
+            return None
+        backend = self._routes[best]
+        if len(self._route_cache) >= self.route_cache_size:
+            self._route_cache.clear()
+        self._route_cache[name] = backend
+        return backend
+
+    async def connect_tcp(self, prefix, host, port, **opts):
+        """
+        Add a backend by TCP.
+        """
+        loop = asyncio.get_running_loop()
+        transpo, proto = await loop.create_connection(
+            lambda: ProxyBackend(self),
+            host, port, **opts)
+        self.add_route(prefix, proto)
+        return proto
+
+    async def connect_unix(self, prefix, path, **opts):
+        """
+        Add a backend by Unix Domain Socket.
+        """
+        loop = asyncio.get_running_loop()
+        transpo, proto = await loop.create_unix_connection(
+            lambda: ProxyBackend(self),
+            path, **opts)
+        self.add_route(prefix, proto)
+        return proto
+
+    async def connect_inherited_socket(self, prefix, sock_fd, **opts):
+        """
+        Add a backend by a connected socket file descriptor.
+        """
+        if isinstance(sock_fd, int):
+            sock = socket.socket(fileno=sock_fd)
+        else:
+            sock = sock_fd
+        loop = asyncio.get_running_loop()
+        transpo, proto = await loop.connect_accepted_socket(
+            lambda: ProxyBackend(self),
+            sock=sock, **opts)
+        self.add_route(prefix, proto)
+        return proto
+
+    async def listen_tcp(self, bind_host, bind_port, **opts):
+        """
+        Listen on TCP.
+
+        Additional options are passed to create_server()
+        """
+        loop = asyncio.get_running_loop()
+
+        server = await loop.create_server(
+            lambda: ProxyFrontend(self),
+            bind_host, bind_port, **opts)
+
+        async with server:
+            await server.serve_forever()
+
+    async def listen_unix(self, socketpath, **opts):
+        """
+        Listen on a Unix Domain Socket.
+
+        Additional options are passed to create_server()
+        """
+        loop = asyncio.get_running_loop()
+
+        server = await loop.create_unix_server(
+            lambda: ProxyFrontend(self),
+            socketpath, **opts)
+
+        async with server:
+            await server.serve_forever()
+
+    async def serve_inherited_socket(self, sock_fd, **opts):
+        """
+        Serve a client connected by inherited socket.
+
+        opts are passed to connect_accepted_socket()
+        """
+        if isinstance(sock_fd, int):
+            sock = socket.socket(fileno=sock_fd)
+        else:
+            sock = sock_fd
+        loop = asyncio.get_running_loop()
+
+        transpo, proto = await loop.connect_accepted_socket(
+            lambda: ProxyFrontend(self),
+            sock=sock, **opts)
+
+        await proto.finished()
+
+    async def close(self):
+        for backend in list(self._backends):
+            backend._transport.close()
@@ -0,0 +1,156 @@
+"""
+Broadcasting events to many subscribers.
+
+Each event is serialized once; subscribers only differ by the channel ID at
+the front of the packet. Topics may be published to from any thread, and
+subscribers may be on different event loops (see urp.sharding).
+"""
+import asyncio
+import collections
+import threading
+
+from .codec import MsgType, make_packer
+
+__all__ = ('Topic', 'Subscription')
+
+
+class Subscription:
+    """
+    Returned from a method to stream a Topic to the caller.
+
+    Made by Topic.subscribe().
+    """
+
+    def __init__(self, topic, maxsize, on_overflow):
+        if on_overflow not in ('drop', 'disconnect'):
+            raise ValueError(f"Unknown overflow policy {on_overflow!r}")
+        self.topic = topic
+        self.maxsize = maxsize
+        self.on_overflow = on_overflow
+        self.dropped = 0
+        self._buffer = collections.deque()
+        self._ready = asyncio.Event()
+        self._header = None
+        self._closed = False
+        self._overflowed = False
+        self._loop = None
+
+    def _offer(self, body):
+        """
+        Called by the topic with the serialized packet body.
+        """
+        if self._closed:
+            return
+        elif len(self._buffer) < self.maxsize:
+            self._buffer.append(self._header + body)
+            self._ready.set()
+        elif self.on_overflow == 'drop':
+            self.dropped += 1
+        else:
+            self._overflowed = True
+            self._buffer.clear()
+            self._close()
+
+    def _close(self):
+        """
+        Stop after the buffered events have been sent.
+        """
+        self._closed = True
+        self._ready.set()
+
+    def _call(self, func, *args):
+        """
+        Call func on the subscription's loop.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            func(*args)
+        else:
+            try:
+                self._loop.call_soon_threadsafe(func, *args)
+            except RuntimeError:
+                # Loop closed
+                pass
+
+    async def run(self, proto, channel_id, send):
+        """
+        Attach to the topic and feed events to the given channel until the
+        topic is closed or the call is cancelled.
+        """
+        packer = make_packer()
+        self._header = packer.pack_array_header(3) + packer.pack(channel_id)
+        self._loop = asyncio.get_running_loop()
+        self.topic._attach(self)
+        try:
+            while True:
+                while self._buffer:
+                    await proto._scheduler(channel_id, self._buffer.popleft())
+                if self._closed:
+                    break
+                self._ready.clear()
+                await self._ready.wait()
+        finally:
+            self.topic._detach(self)
+
+        if self._overflowed:
+            await send(MsgType.Error, '.Overflowed', None)
+
+
+class Topic:
+    """
+    A stream of events that methods can subscribe callers to.
+
+    Get one with Service.topic().
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._subscribers = set()
+        self._packer = make_packer()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def _attach(self, sub):
+        with self._lock:
+            self._subscribers.add(sub)
+
+    def _detach(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def subscribe(self, maxsize=1000, on_overflow='drop'):
+        """
+        Make a Subscription, for a method to return.
+
+        Each subscriber buffers up to maxsize events. When a subscriber falls
+        further behind, on_overflow decides what happens: 'drop' discards new
+        events for that subscriber, 'disconnect' ends its call with an
+        .Overflowed error.
+        """
+        return Subscription(self, maxsize, on_overflow)
+
+    def publish(self, value):
+        """
+        Send a return value to all subscribers.
+        """
+        with self._lock:
+            if not self._subscribers:
+                return
+            body = self._packer.pack(MsgType.Return) + self._packer.pack(value)
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub._call(sub._offer, body)
+
+    def close(self):
+        """
+        End all current subscriptions.
+        """
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub._call(sub._close)
@@ -1,23 +1,21 @@
 import asyncio
+import collections
 import inspect
 
-from .common import MsgType, BaseUrpProtocol, UrpStreamMixin, UrpSubprocessMixin
+from .common import (
+    MsgType, BaseUrpProtocol, UrpStreamMixin, UrpSubprocessMixin, ShapeEncoder,
+)
+from .codec import errors
+from .pubsub import Subscription
 
 __all__ = ()
 
 
-def _fqn(cls):
-    fullname = ""
-    if cls.__module__:
-        fullname = cls.__module__ + "."
-    if hasattr(cls, '__qualname__'):
-        fullname += cls.__qualname__
-    else:
-        fullname += cls.__name__
-    return fullname
-
-
 async def wait_task_and_queue(task, queue):
+    """
+    Produces (from_task, value) for items from the queue, and finally the
+    result of the task.
+    """
     while True:
         qtask = asyncio.create_task(queue.get())
         done, pending = await asyncio.wait(
@@ -25,67 +23,203 @@ async def wait_task_and_queue(task, queue):
         )
         if qtask in pending:
             qtask.cancel()
+            await asyncio.gather(qtask, return_exceptions=True)
 
         # Should we give these in a particular order?
         for t in done:
-            yield await t
+            yield t is task, await t
 
         if task.done():
             break
 
 
+class ChannelReader:
+    """
+    The values a client is streaming to a method, as an async iterator.
+
+    Flow is controlled by granting the client credit for window packets at a
+    time, topped up as they're consumed.
+    """
+
+    def __init__(self, send, window):
+        self._send = send
+        self._window = window
+        self._buffer = collections.deque()
+        self._ready = asyncio.Event()
+        self._ended = False
+        self._consumed = 0
+
+    async def start(self):
+        await self._send(MsgType.Credit, self._window)
+
+    def feed(self, msg):
+        if msg[0] == MsgType.DataEnd:
+            self._ended = True
+        else:
+            self._buffer.append(msg[1])
+        self._ready.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._buffer:
+            if self._ended:
+                raise StopAsyncIteration
+            self._ready.clear()
+            await self._ready.wait()
+
+        value = self._buffer.popleft()
+        self._consumed += 1
+        if self._consumed >= max(1, self._window // 2):
+            await self._send(MsgType.Credit, self._consumed)
+            self._consumed = 0
+        return value
+
+
 class ServerBaseProtocol(BaseUrpProtocol):
+    #: How many streamed packets a client may send ahead of the method
+    urp_stream_window = 16
+
     def __init__(self, router=None):
         super().__init__()
         self.router = router if router is not None else {}
+        self._readers = {}
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        if hasattr(self.router, '_track_connection'):
+            self.router._track_connection(self)
+        threshold = getattr(self.router, 'stall_threshold', None)
+        if threshold is not None:
+            self.urp_watch_stalls(threshold)
+
+    def connection_lost(self, exc):
+        if hasattr(self.router, '_untrack_connection'):
+            self.router._untrack_connection(self)
+        super().connection_lost(exc)
+
+    def _urp_packet_recv(self, msg):
+        reader = self._readers.get(msg[0])
+        if reader is not None and msg[1] in (MsgType.Data, MsgType.DataEnd):
+            reader.feed(msg[1:])
+        elif msg[0] in self._channels or not self._urp_reject(msg):
+            super()._urp_packet_recv(msg)
+
+    def _urp_reject(self, msg):
+        """
+        Checks a new call, replying straight away if it's bad, without
+        opening a channel or starting the method. Returns whether it was
+        rejected.
+        """
+        check = getattr(self.router, '_check_call', None)
+        if check is None or msg[1] != MsgType.Call:
+            return False
+
+        # Anything missing is left for the check to complain about
+        name = msg[2] if len(msg) > 2 else None
+        kwargs = msg[3] if len(msg) > 3 else None
+        options = msg[5] if len(msg) > 5 and isinstance(msg[5], dict) else {}
+        stream = options.get('stream')
+        error = check(name, kwargs, () if stream is None else (stream,))
+        if error is None:
+            return False
+
+        channel_id = msg[0]
+        data = (
+            self._packer.pack([channel_id, MsgType.Error, *error])
+            + self._packer.pack([channel_id, MsgType.Shoosh])
+        )
+        if not self._scheduler.try_send(channel_id, data):
+            # Writes are held up, so wait our turn
+            self._urp_task(self._scheduler(channel_id, data))
+        return True
 
     async def urp_new_channel(self, channel_id, msg):
+        if msg[0] != MsgType.Call:
+            # Straggler for a channel that's already closed
+            return
+
         with self.urp_open_channel(channel_id) as (send, queue):
-            assert msg[0] == MsgType.Call
 
             # TODO: Logging
             # TODO: maybe redirect stdout/stderr?
 
             # Handles channel management and Shooshing
-            task = asyncio.create_task(self._method_task(send, msg[1], msg[2]))
-            async for msg in wait_task_and_queue(task, queue):
-                if msg is None:  # Returned from task
+            options = msg[4] if len(msg) > 4 and isinstance(msg[4], dict) else {}
+            name = msg[1] if len(msg) > 1 else None
+            kwargs = msg[2] if len(msg) > 2 else None
+            task = self._urp_task(
+                self._method_task(channel_id, send, name, kwargs, options))
+            async for from_task, msg in wait_task_and_queue(task, queue):
+                if from_task:
                     await send(MsgType.Shoosh)
                     return
-                # Got from the queue, so list
-                elif msg[0] == MsgType.Shoosh:
+                # Got from the queue, so list (or connection loss)
+                elif msg is None or isinstance(msg, Exception) or msg[0] == MsgType.Shoosh:
+                    # Keep the channel open until the method has actually
+                    # stopped, so stats show any that won't
                     task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
                     return
                 # Anything else is a protocol error
 
-    async def _method_task(self, send, name, kwargs):
+    async def _method_task(self, channel_id, send, name, kwargs, options):
         """
         Responsible for calling the actual method and producing returns
         """
         try:
             meth = self.router[name]
-        except KeyError:
+        except (KeyError, TypeError):
             await send(MsgType.Error, '.NotAMethod', None)
             return
+        if not isinstance(kwargs, dict):
+            await send(MsgType.Error, '.InvalidParameters', {'msg': "Parameters must be a map"})
+            return
+
+        priority = options.get('priority')
+        if not (type(priority) is int and priority >= 1):
+            # Missing or junk from the client
+            priority = getattr(meth, '__urp_priority__', None)
+
+        shape = getattr(meth, '__urp_shape__', None)
+        if shape is not None and options.get('shapes'):
+            ret = ShapeEncoder(send, shape)
+        else:
+            async def ret(val):
+                await send(MsgType.Return, val)
+
+        async def ret_or_subscribe(val):
+            if isinstance(val, Subscription):
+                await val.run(self, channel_id, send)
+            else:
+                await ret(val)
+
+        stream = options.get('stream')
         try:
+            if priority is not None:
+                self.urp_set_priority(channel_id, priority)
+
+            if stream is not None:
+                reader = self._readers[channel_id] = ChannelReader(send, self.urp_stream_window)
+                kwargs = dict(kwargs, **{stream: reader})
+                await reader.start()
+
             methval = meth(**kwargs)
             if inspect.isasyncgenfunction(meth):
                 async for val in methval:
-                    await send(MsgType.Return, val)
+                    await ret(val)
             elif inspect.iscoroutinefunction(meth):
-                await send(MsgType.Return, await methval)
+                await ret_or_subscribe(await methval)
             elif inspect.isgeneratorfunction(meth):
                 for val in methval:
-                    await send(MsgType.Return, val)
+                    await ret(val)
             else:
-                await send(MsgType.Return, methval)
+                await ret_or_subscribe(methval)
         except Exception as exc:
-            additional = {
-                'args': exc.args,
-                'msg': str(exc),
-            }
-            additional.update(vars(exc))
-            await send(MsgType.Error, _fqn(type(exc)), additional)
+            await send(MsgType.Error, *errors.serialize(exc))
+        finally:
+            self._readers.pop(channel_id, None)
 
 
 class ServerStreamProtocol(UrpStreamMixin, ServerBaseProtocol):
@@ -0,0 +1,180 @@
+"""
+Running a service on several event loops in one process.
+
+The accepting loop hands each new connection to the next loop in turn. Each
+connection then lives entirely on its loop, with its own protocol, packer, and
+unpacker. Methods of a sharded service may run on any of the loops' threads
+at the same time, so anything they share must be thread-safe: use
+Service.shared, Topic (whose publish() may be called from any thread), or
+your own locks.
+"""
+import asyncio
+import logging
+import socket
+import threading
+
+__all__ = ('SharedCache',)
+
+log = logging.getLogger(__name__)
+
+
+class SharedCache:
+    """
+    A dict-like cache that's safe to use from multiple threads.
+
+    get_or_create() makes sure the factory is only called once per key, even
+    if several threads ask at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = {}
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def pop(self, key, *default):
+        with self._lock:
+            return self._data.pop(key, *default)
+
+    def get_or_create(self, key, factory):
+        with self._lock:
+            try:
+                return self._data[key]
+            except KeyError:
+                value = self._data[key] = factory()
+                return value
+
+
+class LoopShards:
+    """
+    A number of event loops, each running in its own thread.
+    """
+
+    def __init__(self, count):
+        self.loops = []
+        self._threads = []
+        self._count = count
+
+    def start(self):
+        for i in range(self._count):
+            ready = threading.Event()
+            thread = threading.Thread(
+                target=self._run, args=(ready,), name=f"urp-shard-{i}", daemon=True,
+            )
+            thread.start()
+            ready.wait()
+            self._threads.append(thread)
+
+    def _run(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.loops.append(loop)
+        loop.call_soon(ready.set)
+        try:
+            loop.run_forever()
+            # Clean up what's left
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        finally:
+            loop.close()
+
+    def submit(self, index, coro):
+        """
+        Run a coroutine on the given loop, giving a concurrent.futures.Future.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loops[index])
+
+    def stop(self):
+        for loop in self.loops:
+            loop.call_soon_threadsafe(loop.stop)
+        for thread in self._threads:
+            thread.join()
+        self.loops.clear()
+        self._threads.clear()
+
+
+def tcp_listener(host, port):
+    """
+    Makes a listening TCP socket, like socket.create_server() (which needs
+    Python 3.8).
+    """
+    family, type, proto, _, addr = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, type, proto)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(addr)
+        sock.listen()
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def _handed_off(conn):
+    """
+    Makes a callback for a connection handed to another loop, cleaning up if
+    it couldn't be served.
+    """
+    def _(fut):
+        if fut.cancelled() or fut.exception() is not None:
+            if not fut.cancelled():
+                log.error("Could not serve connection", exc_info=fut.exception())
+            conn.close()
+    return _
+
+
+async def serve_sharded(sock, protocol, loops, **opts):
+    """
+    Accept connections from a listening socket, spreading them round-robin
+    over loops event loops (this one included).
+
+    opts are passed to connect_accepted_socket().
+    """
+    loop = asyncio.get_running_loop()
+    sock.setblocking(False)
+    shards = LoopShards(loops - 1)
+    shards.start()
+    try:
+        index = 0
+        while True:
+            conn, _ = await loop.sock_accept(sock)
+            if index == 0:
+                try:
+                    await loop.connect_accepted_socket(protocol, sock=conn, **opts)
+                except Exception:
+                    log.exception("Could not serve connection")
+                    conn.close()
+            else:
+                target = shards.loops[index - 1]
+                fut = shards.submit(
+                    index - 1, target.connect_accepted_socket(protocol, sock=conn, **opts))
+                fut.add_done_callback(_handed_off(conn))
+            index = (index + 1) % loops
+    finally:
+        shards.stop()
+        sock.close()
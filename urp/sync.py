@@ -0,0 +1,146 @@
+"""
+A minimal blocking client, for scripts and command line tools.
+
+Makes one call at a time over a plain socket. Doesn't use asyncio.
+"""
+import socket
+import sys
+
+from .codec import MsgType, Disconnected, ShapeDecoder, get_error, make_packer, make_unpacker
+
+__all__ = ('SyncClient', 'connect_tcp', 'connect_unix')
+
+
+class SyncClient:
+    """
+    A blocking client over a connected socket.
+
+    client['name'](**args) produces an iterator of returns and errors, like the
+    async client. client.call('name', **args) gives the first return, raising
+    errors.
+    """
+
+    def __init__(self, sock, *, bufsize=65536):
+        self.sock = sock
+        self._bufsize = bufsize
+        self._packer = make_packer()
+        self._unpacker = make_unpacker()
+        self._next_id = 0
+
+    def _send_packet(self, packet):
+        self.sock.sendall(self._packer.pack(packet))
+
+    def _recv_packet(self):
+        """
+        Get the next array packet, handling text packets.
+        """
+        while True:
+            for msg in self._unpacker:
+                if isinstance(msg, str):
+                    self.urp_text_recv(msg)
+                else:
+                    return msg
+            data = self.sock.recv(self._bufsize)
+            if not data:
+                raise Disconnected
+            self._unpacker.feed(data)
+
+    def urp_text_recv(self, txt):
+        """
+        Called when unassociated, unstructured log data is received.
+        """
+        sys.stderr.write(txt)
+
+    def urp_method(self, key, *, shapes=True, tuples=False):
+        """
+        Gets a method, with options. See ClientBaseProtocol.urp_method().
+        """
+        options = {'shapes': True} if shapes else {}
+
+        def call_method(**args):
+            decoder = ShapeDecoder(tuples)
+            chanid = self._next_id
+            self._next_id += 1
+            self._send_packet([chanid, MsgType.Call, key, args, 999, options])
+            finished = False
+            try:
+                while True:
+                    cid, type, *params = self._recv_packet()
+                    if cid != chanid:
+                        # Straggler from an abandoned call
+                        continue
+                    elif type == MsgType.Shoosh:
+                        finished = True
+                        return
+                    elif type == MsgType.Return:
+                        yield decoder(params[0])
+                    elif type == MsgType.Shape:
+                        decoder.set_shape(params[0])
+                    elif type == MsgType.Error:
+                        yield get_error(params[0], params[1])
+                    elif type == MsgType.Log:
+                        # TODO
+                        ...
+            finally:
+                if not finished:
+                    try:
+                        self._send_packet([chanid, MsgType.Shoosh])
+                    except OSError:
+                        pass
+
+        return call_method
+
+    def __getitem__(self, key):
+        """
+        Gets a method.
+
+        Methods take keyword arguments and produce an iterator of returns and
+        errors.
+        """
+        return self.urp_method(key)
+
+    def call(self, key, **args):
+        """
+        Calls a method and gives its first return, raising instead if it
+        errors first. Returns None if the method produced nothing. The rest of
+        the call is Shooshed.
+        """
+        results = self[key](**args)
+        try:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+                return result
+            return None
+        finally:
+            results.close()
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def connect_tcp(host, port, timeout=None):
+    """
+    Connects to the given host/port.
+    """
+    return SyncClient(socket.create_connection((host, port), timeout))
+
+
+def connect_unix(path, timeout=None):
+    """
+    Connects to the given Unix Domain Socket.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except BaseException:
+        sock.close()
+        raise
+    return SyncClient(sock)
@@ -0,0 +1,179 @@
+"""
+Noticing when the event loop is blocked.
+
+A blocked loop stalls every connection on it, so it's worth knowing which
+handler did it. A watchdog thread checks that the loop keeps ticking, and if
+it doesn't for longer than the threshold, grabs the loop thread's stack
+(and the URP method running, if any) while it's still stuck. Once the loop
+gets going again, the stall is logged and handed to the listeners.
+"""
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+
+__all__ = ('Stall', 'StallWatchdog', 'watchdog_for')
+
+log = logging.getLogger(__name__)
+
+_watchdogs = weakref.WeakKeyDictionary()
+_watchdogs_lock = threading.Lock()
+
+
+def _method_name(frame):
+    """
+    Finds the URP method a stack is running, if any.
+    """
+    from .server import ServerBaseProtocol
+    code = ServerBaseProtocol._method_task.__code__
+    while frame is not None:
+        if frame.f_code is code:
+            return frame.f_locals.get('name')
+        frame = frame.f_back
+    return None
+
+
+class Stall:
+    """
+    A time the event loop was blocked.
+
+    stack is the loop thread's stack (as from traceback.format_stack()) and
+    method is the URP method that was running, if any. duration is how long
+    the loop went without ticking.
+    """
+    __slots__ = ('started', 'duration', 'method', 'stack')
+
+    def __init__(self, started, method, stack):
+        self.started = started
+        self.duration = None
+        self.method = method
+        self.stack = stack
+
+    def __repr__(self):
+        return f"<Stall {self.method or 'outside a method'} for {self.duration}s>"
+
+
+class StallWatchdog:
+    """
+    Watches an event loop for stalls longer than threshold seconds.
+
+    Must be started from the loop's thread. Listeners are called with each
+    Stall, on the loop.
+    """
+
+    #: How many stalls to keep
+    history = 100
+
+    def __init__(self, loop, threshold=0.1):
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.stalls = collections.deque(maxlen=self.history)
+        self.listeners = set()
+        self._last = None
+        self._pending = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._loop_thread = None
+        self._handle = None
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self._last = time.monotonic()
+        self._handle = self.loop.call_later(self.interval, self._beat)
+        self._thread = threading.Thread(
+            target=self._watch, name="urp-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def watch(self, listener):
+        """
+        Call listener with each stall.
+        """
+        self.listeners.add(listener)
+
+    def unwatch(self, listener):
+        """
+        Stop calling listener. Once nothing is listening, the watchdog stops.
+        """
+        self.listeners.discard(listener)
+        if not self.listeners:
+            with _watchdogs_lock:
+                if _watchdogs.get(self.loop) is self:
+                    del _watchdogs[self.loop]
+            self.stop()
+
+    def _beat(self):
+        if self._stop.is_set():
+            return
+        now = time.monotonic()
+        stall, self._pending = self._pending, None
+        last, self._last = self._last, now
+        self._handle = self.loop.call_later(self.interval, self._beat)
+        # The watchdog thread may have caught the loop just as it got going
+        # again, giving a stall from before the last beat
+        if stall is not None and stall.started >= last + self.interval:
+            stall.duration = now - last - self.interval
+            self._report(stall)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            if self.loop.is_closed():
+                break
+            last = self._last
+            if last == reported:
+                continue
+            if time.monotonic() - last - self.interval > self.threshold:
+                reported = last
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is None:
+                    continue
+                stall = Stall(
+                    last + self.interval, _method_name(frame),
+                    traceback.format_stack(frame),
+                )
+                del frame
+                if self._last == last:
+                    # Still blocked
+                    self._pending = stall
+
+    def _report(self, stall):
+        self.stalls.append(stall)
+        log.warning(
+            "Event loop blocked for %.3fs in %s:\n%s", stall.duration,
+            stall.method or "no method", "".join(stall.stack),
+        )
+        for listener in list(self.listeners):
+            try:
+                listener(stall)
+            except Exception:
+                log.exception("Error in stall listener %r", listener)
+
+
+def watchdog_for(loop=None, threshold=0.1):
+    """
+    Gets (starting if needed) the watchdog for the given loop (default: the
+    running one).
+
+    threshold only applies if the watchdog is started.
+    """
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    with _watchdogs_lock:
+        try:
+            return _watchdogs[loop]
+        except KeyError:
+            dog = _watchdogs[loop] = StallWatchdog(loop, threshold)
+            dog.start()
+            return dog
@@ -0,0 +1,127 @@
+"""
+Pre-forked servers.
+
+A zygote is a long-lived server process that has already done its imports
+and set up. Instead of starting a fresh interpreter for each server, the
+client asks the zygote to fork a child, connected by a fresh socket pair.
+"""
+import array
+import asyncio
+import os
+import signal
+import socket
+import sys
+import traceback
+
+from .client import client_from_inherited_socket
+
+__all__ = ('Zygote', 'spawn_zygote')
+
+ENV_VAR = 'URP_ZYGOTE_FD'
+
+
+def run_zygote(control_fd, child_main):
+    """
+    Serve fork requests from the given control socket until it closes.
+
+    Each request carries a connected socket, and the child calls
+    child_main(fd) with it.
+    """
+    # Don't leave zombies
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    control = socket.socket(fileno=control_fd)
+    fdsize = array.array('i').itemsize
+
+    while True:
+        msg, ancdata, flags, addr = control.recvmsg(1, socket.CMSG_SPACE(fdsize))
+        if not msg:
+            # Parent went away
+            break
+
+        fds = array.array('i')
+        for level, type, data in ancdata:
+            if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+                fds.frombytes(data[:len(data) - (len(data) % fdsize)])
+
+        for fd in fds:
+            if os.fork() == 0:
+                status = 0
+                try:
+                    control.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    child_main(fd)
+                except BaseException:
+                    traceback.print_exc()
+                    status = 1
+                finally:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    os._exit(status)
+            else:
+                os.close(fd)
+
+    control.close()
+
+
+class Zygote:
+    """
+    A zygote server process. Use spawn() to get a new server from it.
+    """
+
+    def __init__(self, process, control):
+        self.process = process
+        self._control = control
+
+    async def spawn(self):
+        """
+        Fork a new server and connect a client to it.
+        """
+        csock, ssock = socket.socketpair()
+        try:
+            self._control.sendmsg(
+                [b'F'],
+                [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [ssock.fileno()]))],
+            )
+        except BaseException:
+            csock.close()
+            raise
+        finally:
+            ssock.close()
+
+        return await client_from_inherited_socket(csock)
+
+    async def close(self):
+        """
+        Stop the zygote. Servers already spawned keep running.
+        """
+        self._control.close()
+        await self.process.wait()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+async def spawn_zygote(*cmd, **opts):
+    """
+    Run a subprocess that will act as a zygote.
+
+    The command should use Service.run_stdio() (which checks for zygote mode).
+    opts are passed to create_subprocess_exec().
+    """
+    csock, zsock = socket.socketpair()
+    env = dict(opts.pop('env', os.environ))
+    env[ENV_VAR] = str(zsock.fileno())
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd, pass_fds=[zsock.fileno()], env=env, **opts,
+        )
+    except BaseException:
+        csock.close()
+        raise
+    finally:
+        zsock.close()
+
+    return Zygote(process, csock)